@@ -11,8 +11,23 @@ Data: 2025
 """
 
 import os
+import re
+import sys
+import ast
 import json
-from typing import List, Dict, Any, Optional
+import math
+import time
+import hashlib
+import datetime
+import functools
+import inspect
+import tempfile
+import asyncio
+import threading
+import logging
+import logging.handlers
+from collections import OrderedDict, deque
+from typing import List, Dict, Any, Optional, Tuple, Deque, Set
 from dataclasses import dataclass
 from dotenv import load_dotenv
 
@@ -25,42 +40,304 @@ from datapizzai.tools import Tool
 from datapizzai.memory import Memory
 from datapizzai.type import TextBlock, ROLE
 
+# NumPy e Numba sono opzionali: se presenti accelerano i calcoli numerici
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
-@dataclass
+try:
+    from numba import njit, prange
+except ImportError:
+    njit = None
+
+# orjson è opzionale: serializzazione JSON più veloce per i report
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# httpx è opzionale: se presente gli agenti condividono un unico pool di connessioni HTTP
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+# HTTP/2 richiede il pacchetto h2 (pip install httpx[http2])
+try:
+    import h2  # noqa: F401
+    _HTTP2 = True
+except ImportError:
+    _HTTP2 = False
+
+# diskcache è opzionale: se presente le risposte LLM persistono tra un'esecuzione e l'altra
+try:
+    import diskcache
+except ImportError:
+    diskcache = None
+
+
+# Log dei percorsi caldi (messaggi, task, tool): bufferizzati e scritti a blocchi di 64 record
+# invece di un print con flush per riga. Il buffer viene svuotato all'inizio e alla fine di
+# ogni task (_flush_log) e subito per i WARNING, così i log restano in ordine con le print.
+# Livello configurabile con DATAPIZZAI_LOG_LEVEL (es. WARNING per un'esecuzione silenziosa).
+_LOG = logging.getLogger("datapizzai.multiagent")
+if not _LOG.handlers:
+    _stream_handler = logging.StreamHandler(sys.stdout)
+    _stream_handler.setFormatter(logging.Formatter("%(message)s"))
+    _LOG.addHandler(logging.handlers.MemoryHandler(capacity=64, flushLevel=logging.WARNING,
+                                                   target=_stream_handler))
+    # Un nome di livello non valido non deve impedire l'import del modulo: si resta su INFO
+    _livello = logging.getLevelName(os.getenv("DATAPIZZAI_LOG_LEVEL", "INFO").upper())
+    _LOG.setLevel(_livello if isinstance(_livello, int) else logging.INFO)
+
+
+def _flush_log() -> None:
+    """Scrive i log ancora in buffer (da chiamare prima di stampare i risultati)"""
+    for handler in _LOG.handlers:
+        handler.flush()
+
+
+@dataclass(slots=True, frozen=True)
 class AgentMessage:
-    """Messaggio tra agenti"""
+    """Messaggio tra agenti (immutabile, senza __dict__ per istanza)"""
     sender: str
     receiver: str
     content: str
     task_id: str
     message_type: str = "request"  # request, response, info
+    
+    def __post_init__(self):
+        # Nomi agente e tipi si ripetono in ogni messaggio: internati condividono
+        # un'unica copia e il confronto tra chiavi diventa un confronto di puntatori
+        object.__setattr__(self, "sender", sys.intern(self.sender))
+        object.__setattr__(self, "receiver", sys.intern(self.receiver))
+        object.__setattr__(self, "message_type", sys.intern(self.message_type))
+
+
+# Parole chiave che attivano gli agenti specializzati in execute_complex_task
+MATH_KEYS = frozenset({"calcola", "matematica", "formula"})
+DATA_KEYS = frozenset({"dati", "analisi", "statistiche"})
+RESEARCH_KEYS = frozenset({"cerca", "informazioni", "ricerca"})
+
+
+def _keyword_pattern(keys: frozenset) -> "re.Pattern[str]":
+    """Compila le parole chiave in un'unica alternativa (match anche come sottostringa)"""
+    return re.compile("|".join(re.escape(k) for k in sorted(keys, key=len, reverse=True)))
+
+
+_MATH_RE = _keyword_pattern(MATH_KEYS)
+_DATA_RE = _keyword_pattern(DATA_KEYS)
+_RESEARCH_RE = _keyword_pattern(RESEARCH_KEYS)
+
+
+def _anteprima(testo: str, limite: int) -> str:
+    """Tronca il testo a `limite` caratteri, senza copiarlo se è già corto"""
+    return testo if len(testo) <= limite else testo[:limite] + "..."
+
+
+def _riepilogo(results: Dict[str, str], limite: int, indent: str = "") -> str:
+    """Una riga 'chiave: anteprima' per ogni risultato"""
+    return "\n".join(f"{indent}{k}: {_anteprima(v, limite)}" for k, v in results.items())
+
+
+# ==============================================================================
+# CACHE RISPOSTE LLM
+# ==============================================================================
+
+# Cache LRU delle risposte: chiave -> (testo, tool call serializzati in JSON)
+_RESPONSE_CACHE: "OrderedDict[str, Tuple[str, str]]" = OrderedDict()
+_RESPONSE_CACHE_SIZE = 256
+# Gli agenti possono lavorare in thread paralleli: l'OrderedDict va protetto
+_RESPONSE_CACHE_LOCK = threading.Lock()
+
+# DATAPIZZAI_NO_CACHE=1 disattiva sia la cache in memoria sia quella su disco
+_NO_CACHE = os.getenv("DATAPIZZAI_NO_CACHE") == "1"
+
+# Cache persistente su disco (LRU, max 100 MB, scadenza 7 giorni)
+_DISK_CACHE_TTL = 7 * 24 * 3600
+_DISK_CACHE = None
+if diskcache is not None and not _NO_CACHE:
+    _DISK_CACHE = diskcache.Cache(
+        os.path.join(tempfile.gettempdir(), 'datapizzai_agent_cache'),
+        size_limit=100 * 1024 * 1024,
+        eviction_policy='least-recently-used'
+    )
+
+
+def _response_cache_key(agent_name: str, model: str, system_prompt: str, task: str) -> str:
+    """Calcola la chiave di cache per (agente, modello, system prompt, task)"""
+    # Normalizza spazi e maiuscole per intercettare task quasi identici
+    normalized_task = " ".join(task.lower().split())
+    prompt_hash = hashlib.blake2b(system_prompt.encode(), digest_size=8).hexdigest()
+    return hashlib.blake2b(
+        f"{agent_name}|{model}|{prompt_hash}|{normalized_task}".encode(), digest_size=16
+    ).hexdigest()
+
+
+def _cache_get(key: str) -> Optional[Tuple[str, str]]:
+    """Legge una risposta dalla cache (memoria, poi disco) aggiornandone la posizione LRU"""
+    with _RESPONSE_CACHE_LOCK:
+        entry = _RESPONSE_CACHE.get(key)
+        if entry is not None:
+            _RESPONSE_CACHE.move_to_end(key)
+            return entry
+    
+    if _DISK_CACHE is not None:
+        entry = _DISK_CACHE.get(key)
+        if entry is not None:
+            entry = tuple(entry)
+            _cache_put(key, *entry, persist=False)
+    return entry
+
+
+def _cache_put(key: str, text: str, tool_calls_json: str, persist: bool = True):
+    """Salva una risposta in cache, eliminando la meno recente se piena"""
+    with _RESPONSE_CACHE_LOCK:
+        _RESPONSE_CACHE[key] = (text, tool_calls_json)
+        _RESPONSE_CACHE.move_to_end(key)
+        if len(_RESPONSE_CACHE) > _RESPONSE_CACHE_SIZE:
+            _RESPONSE_CACHE.popitem(last=False)
+    
+    if persist and _DISK_CACHE is not None:
+        _DISK_CACHE.set(key, (text, tool_calls_json), expire=_DISK_CACHE_TTL)
+
+
+def _message_key(message: AgentMessage) -> Tuple[str, str, int]:
+    """Chiave di deduplicazione: (mittente, destinatario, hash del contenuto)"""
+    return (message.sender, message.receiver, hash(message.content))
 
 
 class MessageBus:
-    """Sistema di messaggistica tra agenti"""
+    """Sistema di messaggistica tra agenti
     
-    def __init__(self):
-        self.messages: List[AgentMessage] = []
+    Ogni agente ha una casella (deque limitata) letta solo da lui: quando è piena il
+    messaggio più vecchio viene scartato e contato in messaggi_scartati. Un messaggio identico
+    (stesso mittente, destinatario e contenuto) a uno ancora in attesa viene scartato.
+    Le operazioni sulle caselle sono protette da un lock breve, quindi più agenti possono
+    inviare da thread diversi.
+    """
+    
+    def __init__(self, mailbox_size: int = 1024):
+        # Oltre il limite i messaggi più vecchi vengono scartati (e contati)
+        if mailbox_size <= 0:
+            raise ValueError(f"❌ mailbox_size deve essere positiva, non {mailbox_size}")
+        
+        self.mailbox_size = mailbox_size
+        self.mailboxes: Dict[str, Deque[AgentMessage]] = {}
         self.subscribers: Dict[str, List[str]] = {}
+        self.message_count = 0
+        self.messaggi_scartati = 0
+        # Chiavi dei messaggi in attesa di essere letti
+        self._pending: Set[Tuple[str, str, int]] = set()
+        self._lock = threading.Lock()
+    
+    def _mailbox(self, agent_name: str) -> Deque[AgentMessage]:
+        """Restituisce (creandola se serve) la casella di un agente; da chiamare col lock"""
+        mailbox = self.mailboxes.get(agent_name)
+        if mailbox is None:
+            mailbox = self.mailboxes[agent_name] = deque(maxlen=self.mailbox_size)
+        return mailbox
     
     def send_message(self, message: AgentMessage):
         """Invia un messaggio"""
-        self.messages.append(message)
-        print(f"📨 {message.sender} → {message.receiver}: {message.content[:50]}...")
+        key = _message_key(message)
+        with self._lock:
+            if key in self._pending:
+                return
+            
+            mailbox = self._mailbox(message.receiver)
+            scartato = None
+            if len(mailbox) == mailbox.maxlen:
+                # Il messaggio più vecchio sta per essere scartato dalla deque
+                scartato = mailbox[0]
+                self._pending.discard(_message_key(scartato))
+                self.messaggi_scartati += 1
+            mailbox.append(message)
+            self._pending.add(key)
+            self.message_count += 1
+        
+        if scartato is not None:
+            _LOG.warning("⚠️ Casella di %s piena: scartato il messaggio di %s",
+                         message.receiver, scartato.sender)
+        _LOG.info("📨 %s → %s: %.50s...", message.sender, message.receiver, message.content)
     
     def get_messages_for_agent(self, agent_name: str) -> List[AgentMessage]:
         """Ottieni messaggi per un agente specifico"""
-        return [msg for msg in self.messages if msg.receiver == agent_name]
+        with self._lock:
+            return list(self.mailboxes.get(agent_name, ()))
     
     def clear_messages_for_agent(self, agent_name: str):
         """Pulisce i messaggi per un agente"""
-        self.messages = [msg for msg in self.messages if msg.receiver != agent_name]
+        self.drain_messages_for_agent(agent_name)
+    
+    def drain_messages_for_agent(self, agent_name: str) -> List[AgentMessage]:
+        """Restituisce e rimuove in un solo passo i messaggi per un agente"""
+        with self._lock:
+            mailbox = self.mailboxes.get(agent_name)
+            if not mailbox:
+                return []
+            messages = list(mailbox)
+            mailbox.clear()
+            for message in messages:
+                self._pending.discard(_message_key(message))
+            return messages
 
 
 # ==============================================================================
 # DEFINIZIONE STRUMENTI SPECIALIZZATI
 # ==============================================================================
 
+# Funzioni matematiche disponibili nelle espressioni
+_CALC_NAMESPACE = {
+    'sin': math.sin, 'cos': math.cos, 'tan': math.tan,
+    'log': math.log, 'sqrt': math.sqrt, 'pi': math.pi,
+    'e': math.e, 'pow': math.pow
+}
+
+
+# Qualsiasi carattere fuori da '0123456789+-*/(). sincostanloge,[]' rende l'espressione non valida
+_CALC_DISALLOWED_RE = re.compile(r'[^0-9+\-*/(). sincostanloge,\[\]]')
+
+
+@functools.lru_cache(maxsize=256)
+def _compile_expr(espressione: str):
+    """Compila un'espressione una sola volta e riusa il bytecode"""
+    return compile(espressione, '<calc>', 'eval')
+
+
+def _interesse_composto(capitale: float, tasso: float, anni: float) -> float:
+    """Montante con interesse composto: C*(1+r)^t
+    
+    Resta Python puro: per un solo valore per chiamata la compilazione JIT di Numba
+    costerebbe più dell'intero calcolo.
+    """
+    return capitale * (1 + tasso) ** anni
+
+
+_KERNEL_FINANZIARI = {"interesse_composto": _interesse_composto}
+
+
+def _parse_chiamata_finanziaria(espressione: str) -> Optional[Tuple[str, List[float]]]:
+    """Riconosce chiamate del tipo nome(a, b, c) con argomenti numerici"""
+    try:
+        node = ast.parse(espressione.strip(), mode='eval').body
+    except SyntaxError:
+        return None
+    
+    if not (isinstance(node, ast.Call) and isinstance(node.func, ast.Name)):
+        return None
+    if node.func.id not in _KERNEL_FINANZIARI or node.keywords:
+        return None
+    
+    try:
+        args = [float(ast.literal_eval(arg)) for arg in node.args]
+    except (ValueError, TypeError):
+        return None
+    
+    return node.func.id, args
+
+
 @Tool
 def calcola_avanzato(espressione: str, tipo_calcolo: str = "base") -> str:
     """Esegue calcoli matematici avanzati.
@@ -73,72 +350,117 @@ def calcola_avanzato(espressione: str, tipo_calcolo: str = "base") -> str:
         Risultato del calcolo
     """
     try:
-        import math
-        import statistics
-        
-        # Aggiungi funzioni matematiche al namespace
-        namespace = {
-            'sin': math.sin, 'cos': math.cos, 'tan': math.tan,
-            'log': math.log, 'sqrt': math.sqrt, 'pi': math.pi,
-            'e': math.e, 'pow': math.pow
-        }
-        
         if tipo_calcolo == "finanziario":
             # Calcoli finanziari (es: interesse composto)
             if "interesse_composto" in espressione:
                 # Formato: interesse_composto(capitale, tasso, anni)
+                chiamata = _parse_chiamata_finanziaria(espressione)
+                if chiamata and len(chiamata[1]) == 3:
+                    nome, args = chiamata
+                    result = _KERNEL_FINANZIARI[nome](*args)
+                    return f"Risultato {tipo_calcolo}: {result}"
                 return "Calcolo finanziario: usa la formula C*(1+r)^t"
         
         # Validazione sicurezza
-        allowed_chars = set('0123456789+-*/(). sincostanloge,[]')
-        if not all(c in allowed_chars for c in espressione.replace(' ', '')):
+        if _CALC_DISALLOWED_RE.search(espressione):
             return "Errore: Caratteri non permessi"
         
-        result = eval(espressione, namespace)
+        result = eval(_compile_expr(espressione), dict(_CALC_NAMESPACE))
         return f"Risultato {tipo_calcolo}: {result}"
         
     except Exception as e:
         return f"Errore calcolo: {str(e)}"
 
 
-@Tool
-def analizza_dati(dati: str, tipo_analisi: str = "base") -> str:
-    """Analizza dati e fornisce statistiche.
+# Sotto questa dimensione il costo di avvio dei thread Numba supera il guadagno
+_NUMBA_MIN_SIZE = 10_000
+
+if njit is not None:
+    @njit(parallel=True, fastmath=True, cache=True)
+    def _fast_moments(a):
+        """Media, varianza e deviazione standard campionarie in un solo passaggio parallelo"""
+        n = a.size
+        # Traslazione sul primo valore: evita la cancellazione numerica di s2/n - media^2
+        k = a[0]
+        s = 0.0
+        s2 = 0.0
+        for i in prange(n):
+            d = a[i] - k
+            s += d
+            s2 += d * d
+        mean = k + s / n
+        var = (s2 - s * s / n) / (n - 1)
+        return mean, var, math.sqrt(var)
+else:
+    _fast_moments = None
+
+
+def _statistiche_numeriche(data, avanzata: bool) -> Dict[str, Any]:
+    """Calcola le statistiche descrittive di una lista (o array float64) di numeri"""
+    if np is not None:
+        # Riduzioni vettoriali su un unico buffer float64
+        arr = np.asarray(data, dtype=np.float64)
+        n = arr.size
+        risultati = {
+            "count": n,
+            "media": float(arr.mean()),
+            "mediana": float(np.median(arr)),
+            "min": float(arr.min()),
+            "max": float(arr.max())
+        }
+        if avanzata:
+            if _fast_moments is not None and n >= _NUMBA_MIN_SIZE:
+                _, varianza, deviazione = _fast_moments(arr)
+                varianza, deviazione = float(varianza), float(deviazione)
+            elif n > 1:
+                varianza = float(arr.var(ddof=1))
+                deviazione = math.sqrt(varianza)
+            else:
+                varianza = deviazione = 0
+            risultati.update({
+                "deviazione_standard": deviazione,
+                "varianza": varianza
+            })
+        return risultati
     
-    Args:
-        dati: Dati da analizzare (formato JSON o lista)
-        tipo_analisi: Tipo di analisi (base, avanzata, trend)
+    import statistics
     
-    Returns:
-        Risultati dell'analisi
-    """
+    risultati = {
+        "count": len(data),
+        "media": statistics.mean(data),
+        "mediana": statistics.median(data),
+        "min": min(data),
+        "max": max(data)
+    }
+    if avanzata:
+        risultati.update({
+            "deviazione_standard": statistics.stdev(data) if len(data) > 1 else 0,
+            "varianza": statistics.variance(data) if len(data) > 1 else 0
+        })
+    return risultati
+
+
+@functools.lru_cache(maxsize=512)
+def _analizza_dati_cached(dati: str, tipo_analisi: str) -> str:
+    """Calcolo puro dell'analisi, memorizzato per (dati, tipo_analisi)"""
     try:
-        import json
-        import statistics
-        
         # Prova a parsare come JSON
         if dati.startswith('[') or dati.startswith('{'):
             data = json.loads(dati)
+            numerica = isinstance(data, list) and all(isinstance(x, (int, float)) for x in data)
+        elif np is not None:
+            # Lista di numeri separati da virgola, convertita direttamente in float64:
+            # l'array passa così com'è a _statistiche_numeriche, senza altre copie
+            data = np.array(dati.split(','), dtype=np.float64)
+            numerica = True
         else:
             # Assume lista di numeri separati da virgola
             data = [float(x.strip()) for x in dati.split(',')]
+            numerica = True
         
-        if isinstance(data, list) and all(isinstance(x, (int, float)) for x in data):
+        if numerica:
             # Analisi numerica
-            risultati = {
-                "count": len(data),
-                "media": statistics.mean(data),
-                "mediana": statistics.median(data),
-                "min": min(data),
-                "max": max(data)
-            }
-            
-            if tipo_analisi == "avanzata":
-                risultati.update({
-                    "deviazione_standard": statistics.stdev(data) if len(data) > 1 else 0,
-                    "varianza": statistics.variance(data) if len(data) > 1 else 0
-                })
-            
+            risultati = _statistiche_numeriche(data, tipo_analisi == "avanzata")
             return f"Analisi {tipo_analisi}: {json.dumps(risultati, indent=2)}"
         
         return f"Analisi {tipo_analisi} completata per {len(data)} elementi"
@@ -148,18 +470,22 @@ def analizza_dati(dati: str, tipo_analisi: str = "base") -> str:
 
 
 @Tool
-def cerca_informazioni_avanzate(query: str, dominio: str = "generale") -> str:
-    """Cerca informazioni specializzate per dominio.
+def analizza_dati(dati: str, tipo_analisi: str = "base") -> str:
+    """Analizza dati e fornisce statistiche.
     
     Args:
-        query: Query di ricerca
-        dominio: Dominio specializzato (tech, business, science)
+        dati: Dati da analizzare (formato JSON o lista)
+        tipo_analisi: Tipo di analisi (base, avanzata, trend)
     
     Returns:
-        Informazioni specializzate
+        Risultati dell'analisi
     """
-    query_lower = query.lower()
-    
+    return _analizza_dati_cached(dati, tipo_analisi)
+
+
+@functools.lru_cache(maxsize=512)
+def _cerca_informazioni_lookup(query_lower: str, dominio: str) -> Optional[str]:
+    """Risolve la query sulla base informativa statica; None se non trovata"""
     if dominio == "tech":
         if "python" in query_lower:
             return """Informazioni Tech - Python:
@@ -191,27 +517,30 @@ def cerca_informazioni_avanzate(query: str, dominio: str = "generale") -> str:
 - Distribuzione normale: 68-95-99.7 rule
 - P-value: soglia significatività tipica 0.05"""
     
-    return f"Informazioni {dominio} per '{query}': ricerca in corso..."
+    return None
 
 
 @Tool
-def genera_report(titolo: str, contenuto: str, formato: str = "markdown") -> str:
-    """Genera report strutturati.
+def cerca_informazioni_avanzate(query: str, dominio: str = "generale") -> str:
+    """Cerca informazioni specializzate per dominio.
     
     Args:
-        titolo: Titolo del report
-        contenuto: Contenuto del report
-        formato: Formato output (markdown, json, text)
+        query: Query di ricerca
+        dominio: Dominio specializzato (tech, business, science)
     
     Returns:
-        Report formattato
+        Informazioni specializzate
     """
-    import datetime
+    info = _cerca_informazioni_lookup(query.lower(), dominio)
+    if info is not None:
+        return info
     
-    timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    
-    if formato == "markdown":
-        report = f"""# {titolo}
+    return f"Informazioni {dominio} per '{query}': ricerca in corso..."
+
+
+def _report_markdown(titolo: str, contenuto: str, timestamp: str) -> str:
+    """Report in formato markdown"""
+    return f"""# {titolo}
 
 **Generato il:** {timestamp}
 
@@ -222,24 +551,59 @@ def genera_report(titolo: str, contenuto: str, formato: str = "markdown") -> str
 ---
 *Report generato automaticamente dal sistema multi-agente*
 """
-    
-    elif formato == "json":
-        report_data = {
-            "titolo": titolo,
-            "timestamp": timestamp,
-            "contenuto": contenuto,
-            "formato": formato
-        }
-        report = json.dumps(report_data, indent=2, ensure_ascii=False)
-    
-    else:  # text
-        report = f"""{titolo}
+
+
+def _report_json(titolo: str, contenuto: str, timestamp: str) -> str:
+    """Report in formato JSON"""
+    report_data = {
+        "titolo": titolo,
+        "timestamp": timestamp,
+        "contenuto": contenuto,
+        "formato": "json"
+    }
+    if orjson is not None:
+        return orjson.dumps(report_data, option=orjson.OPT_INDENT_2).decode()
+    return json.dumps(report_data, indent=2, ensure_ascii=False)
+
+
+def _report_text(titolo: str, contenuto: str, timestamp: str) -> str:
+    """Report in formato testo semplice"""
+    return f"""{titolo}
 {'=' * len(titolo)}
 
 Generato: {timestamp}
 
 {contenuto}
 """
+
+
+_REPORT_FORMATTERS = {
+    "markdown": _report_markdown,
+    "json": _report_json,
+    "text": _report_text
+}
+
+
+@functools.lru_cache(maxsize=1)
+def _timestamp_report(secondo: int) -> str:
+    """Timestamp formattato, ricalcolato al massimo una volta al secondo"""
+    return datetime.datetime.fromtimestamp(secondo).strftime("%Y-%m-%d %H:%M:%S")
+
+
+@Tool
+def genera_report(titolo: str, contenuto: str, formato: str = "markdown") -> str:
+    """Genera report strutturati.
+    
+    Args:
+        titolo: Titolo del report
+        contenuto: Contenuto del report
+        formato: Formato output (markdown, json, text)
+    
+    Returns:
+        Report formattato
+    """
+    timestamp = _timestamp_report(int(time.time()))
+    report = _REPORT_FORMATTERS.get(formato, _report_text)(titolo, contenuto, timestamp)
     
     return f"Report '{titolo}' generato in formato {formato}"
 
@@ -275,94 +639,232 @@ Coordinazione attiva."""
 # DEFINIZIONE AGENTI SPECIALIZZATI
 # ==============================================================================
 
+# Tipo di blocco -> True se è un tool call (name + arguments), determinato al primo incontro
+_TOOL_CALL_BLOCK_TYPES: Dict[type, bool] = {}
+
+
+# Event loop di lunga durata su cui girano le versioni sincrone dei metodi asincroni.
+# I client asincroni condivisi (_get_client, pool httpx) restano legati a un solo loop
+# invece di uno nuovo per ogni asyncio.run, che li lascerebbe su un loop già chiuso
+_ASYNC_LOOP: Optional[asyncio.AbstractEventLoop] = None
+_ASYNC_LOOP_LOCK = threading.Lock()
+
+
+def _run_async(coro):
+    """Esegue la coroutine sul loop condiviso (in un thread dedicato) e ne attende il risultato
+    
+    Funziona anche se il chiamante è già dentro un loop attivo (es. notebook), dove
+    asyncio.run solleverebbe RuntimeError; lì conviene comunque usare await sulla
+    versione asincrona, per non bloccare il loop del chiamante.
+    """
+    global _ASYNC_LOOP
+    with _ASYNC_LOOP_LOCK:
+        if _ASYNC_LOOP is None:
+            _ASYNC_LOOP = asyncio.new_event_loop()
+            threading.Thread(target=_ASYNC_LOOP.run_forever, name="agenti-asyncio", daemon=True).start()
+    try:
+        running = asyncio.get_running_loop()
+    except RuntimeError:
+        running = None
+    if running is _ASYNC_LOOP:
+        coro.close()
+        raise RuntimeError("_run_async chiamato dal loop condiviso: usa await sulla versione asincrona")
+    return asyncio.run_coroutine_threadsafe(coro, _ASYNC_LOOP).result()
+
+
+@functools.lru_cache(maxsize=1)
+def _shared_http_kwargs() -> Dict[str, Any]:
+    """Client HTTP condivisi da tutti gli agenti, se ClientFactory.create li accetta
+    
+    Un solo pool keep-alive (e, con h2, una connessione HTTP/2 multiplexata) evita
+    a ogni agente il proprio handshake TCP/TLS. Se httpx manca o la factory non
+    espone i parametri, ogni client usa il proprio pool come prima.
+    """
+    if httpx is None:
+        return {}
+    try:
+        params = inspect.signature(ClientFactory.create).parameters
+    except (TypeError, ValueError):
+        return {}
+    
+    limits = httpx.Limits(max_keepalive_connections=8, max_connections=16)
+    kwargs = {}
+    if "http_client" in params:
+        kwargs["http_client"] = httpx.Client(limits=limits, http2=_HTTP2, timeout=30.0)
+    if "async_http_client" in params:
+        kwargs["async_http_client"] = httpx.AsyncClient(limits=limits, http2=_HTTP2, timeout=30.0)
+    return kwargs
+
+
+@functools.lru_cache(maxsize=16)
+def _get_client(provider: str, model: str, system_prompt: str):
+    """Crea un client per (provider, modello, system prompt) e lo riusa nelle chiamate successive"""
+    return ClientFactory.create(
+        provider=provider,
+        api_key=os.getenv("OPENAI_API_KEY"),
+        model=model,
+        system_prompt=system_prompt,
+        **_shared_http_kwargs()
+    )
+
+
 class SpecializedAgent:
     """Agente specializzato con competenze specifiche"""
     
     def __init__(self, name: str, specialization: str, tools: List, system_prompt: str, message_bus: MessageBus):
-        self.name = name
+        self.name = sys.intern(name)
         self.specialization = specialization
         self.tools = tools
+        # Mappa nome -> tool costruita una volta sola: gli strumenti non cambiano
+        self._tool_map: Dict[str, Any] = {tool.name: tool for tool in tools}
+        self._tool_names = frozenset(self._tool_map)
+        self.system_prompt = system_prompt
+        self.model = "gpt-4o"
         self.message_bus = message_bus
         self.memory = Memory()
         
-        # Crea client OpenAI
-        self.client = ClientFactory.create(
-            provider="openai",
-            api_key=os.getenv("OPENAI_API_KEY"),
-            model="gpt-4o",
-            system_prompt=system_prompt
-        )
+        # Crea client OpenAI (riusato se già creato con lo stesso prompt)
+        self.client = _get_client("openai", self.model, system_prompt)
         
         if not self.client:
             raise ValueError(f"❌ Impossibile creare client per {name}")
     
-    def process_task(self, task: str, task_id: str = "default") -> str:
-        """Elabora un task utilizzando i propri strumenti"""
-        
-        print(f"\n🤖 {self.name} ({self.specialization}) elabora: {task[:50]}...")
+    def _prepare_task(self, task: str) -> str:
+        """Unisce al task i messaggi ricevuti e lo registra in memoria"""
+        _LOG.info("\n🤖 %s (%s) elabora: %.50s...", self.name, self.specialization, task)
         
         # Controlla messaggi da altri agenti
-        messages = self.message_bus.get_messages_for_agent(self.name)
+        messages = self.message_bus.drain_messages_for_agent(self.name)
         context = ""
         if messages:
             context = f"\nMessaggi ricevuti:\n" + "\n".join([f"- {msg.sender}: {msg.content}" for msg in messages])
-            self.message_bus.clear_messages_for_agent(self.name)
         
         # Aggiungi task alla memoria
         full_task = task + context
         self.memory.add_turn([TextBlock(content=full_task)], ROLE.USER)
+        return full_task
+    
+    def _lookup_cache(self, full_task: str, bypass_cache: bool) -> Tuple[str, Optional[Tuple[str, List]]]:
+        """Restituisce la chiave di cache e l'eventuale risposta (testo, tool call) già memorizzata"""
+        cache_key = _response_cache_key(self.name, self.model, self.system_prompt, full_task)
+        cached = None if bypass_cache or _NO_CACHE else _cache_get(cache_key)
+        
+        if cached is None:
+            return cache_key, None
+        
+        text, tool_calls_json = cached
+        _LOG.info("   📦 Risposta da cache per %s", self.name)
+        return cache_key, (text, [tuple(call) for call in json.loads(tool_calls_json)])
+    
+    def _store_response(self, cache_key: str, response) -> Tuple[str, List]:
+        """Estrae testo e tool call dalla risposta e li salva in cache"""
+        text = response.text
+        tool_calls = self._extract_tool_calls(response)
+        if not _NO_CACHE:
+            _cache_put(cache_key, text, json.dumps(tool_calls))
+        return text, tool_calls
+    
+    def _finalize(self, text: str, tool_calls: List) -> str:
+        """Esegue i tool richiesti e determina l'output finale"""
+        # Esegui tool se presenti
+        tool_results = self._execute_tool_calls(tool_calls)
+        
+        # Determina output finale
+        if text.strip():
+            result = text
+        elif tool_results:
+            result = f"Operazioni completate: {'; '.join(tool_results[:2])}"
+        else:
+            result = "Task elaborato senza strumenti specifici"
+        
+        _LOG.info("✅ %s: %.100s...", self.name, result)
+        return result
+    
+    def process_task(self, task: str, task_id: str = "default", bypass_cache: bool = False) -> str:
+        """Elabora un task utilizzando i propri strumenti
+        
+        Le risposte del modello sono memorizzate in cache per (agente, modello, system prompt, task),
+        in memoria e, se diskcache è installato, su disco: un task già visto non ripete la
+        chiamata OpenAI. Usa bypass_cache=True (o DATAPIZZAI_NO_CACHE=1) per forzarla.
+        """
+        full_task = self._prepare_task(task)
         
         try:
-            # Usa input diretto invece della memoria per evitare problemi con tool calls
-            response = self.client.invoke(
-                input=full_task,
-                tools=self.tools,
-                tool_choice="auto"
-            )
-            
-            # Esegui tool se presenti
-            tool_results = self._execute_tool_calls(response)
+            cache_key, cached = self._lookup_cache(full_task, bypass_cache)
             
-            # Determina output finale
-            if response.text.strip():
-                result = response.text
-            elif tool_results:
-                result = f"Operazioni completate: {'; '.join(tool_results[:2])}"
+            if cached is not None:
+                text, tool_calls = cached
             else:
-                result = "Task elaborato senza strumenti specifici"
+                # Usa input diretto invece della memoria per evitare problemi con tool calls
+                response = self.client.invoke(
+                    input=full_task,
+                    tools=self.tools,
+                    tool_choice="auto"
+                )
+                text, tool_calls = self._store_response(cache_key, response)
             
-            print(f"✅ {self.name}: {result[:100]}...")
-            return result
+            return self._finalize(text, tool_calls)
             
         except Exception as e:
             error_msg = f"Errore in {self.name}: {str(e)}"
-            print(f"❌ {error_msg}")
+            _LOG.error("❌ %s", error_msg)
             return error_msg
     
-    def _execute_tool_calls(self, response) -> List[str]:
-        """Esegue i tool call presenti nella risposta"""
-        tool_results = []
+    async def process_task_async(self, task: str, task_id: str = "default", bypass_cache: bool = False) -> str:
+        """Versione asincrona di process_task basata su client.a_invoke"""
+        full_task = self._prepare_task(task)
         
-        # Mappa dei tool disponibili
-        tool_map = {tool.name: tool for tool in self.tools}
+        try:
+            cache_key, cached = self._lookup_cache(full_task, bypass_cache)
+            
+            if cached is not None:
+                text, tool_calls = cached
+            else:
+                response = await self.client.a_invoke(
+                    input=full_task,
+                    tools=self.tools,
+                    tool_choice="auto"
+                )
+                text, tool_calls = self._store_response(cache_key, response)
+            
+            return self._finalize(text, tool_calls)
+            
+        except Exception as e:
+            error_msg = f"Errore in {self.name}: {str(e)}"
+            _LOG.error("❌ %s", error_msg)
+            return error_msg
+    
+    def _extract_tool_calls(self, response) -> List[Tuple[str, Dict[str, Any]]]:
+        """Estrae (nome, argomenti) dei tool call presenti nella risposta"""
+        tool_calls = []
         
         for block in response.content:
-            if hasattr(block, 'name') and hasattr(block, 'arguments'):
-                tool_name = block.name
-                arguments = block.arguments
-                
-                if tool_name in tool_map:
-                    try:
-                        result = tool_map[tool_name](**arguments)
-                        tool_results.append(result)
-                        print(f"   🔧 {tool_name}: {result[:50]}...")
-                        
-
-                        
-                    except Exception as e:
-                        error_msg = f"Errore tool {tool_name}: {e}"
-                        tool_results.append(error_msg)
-                        print(f"   ❌ {error_msg}")
+            block_type = type(block)
+            is_tool_call = _TOOL_CALL_BLOCK_TYPES.get(block_type)
+            if is_tool_call is None:
+                # Primo blocco di questo tipo: verifica gli attributi una volta sola
+                is_tool_call = hasattr(block, 'name') and hasattr(block, 'arguments')
+                _TOOL_CALL_BLOCK_TYPES[block_type] = is_tool_call
+            if is_tool_call:
+                tool_calls.append((block.name, block.arguments))
+        
+        return tool_calls
+    
+    def _execute_tool_calls(self, tool_calls: List[Tuple[str, Dict[str, Any]]]) -> List[str]:
+        """Esegue i tool call estratti dalla risposta"""
+        tool_results = []
+        
+        for tool_name, arguments in tool_calls:
+            if tool_name in self._tool_names:
+                try:
+                    result = self._tool_map[tool_name](**arguments)
+                    tool_results.append(result)
+                    _LOG.info("   🔧 %s: %.50s...", tool_name, result)
+                    
+                except Exception as e:
+                    error_msg = f"Errore tool {tool_name}: {e}"
+                    tool_results.append(error_msg)
+                    _LOG.error("   ❌ %s", error_msg)
         
         return tool_results
     
@@ -447,67 +949,73 @@ class MultiAgentSystem:
     
     def execute_complex_task(self, task_description: str) -> Dict[str, Any]:
         """Esegue un task complesso coordinando più agenti"""
+        return _run_async(self.execute_complex_task_async(task_description))
+    
+    async def execute_complex_task_async(self, task_description: str) -> Dict[str, Any]:
+        """Esegue un task complesso coordinando più agenti (versione asincrona)"""
         
+        _flush_log()
         print(f"\n{'='*70}")
         print(f"🎯 TASK COMPLESSO: {task_description}")
         print(f"{'='*70}")
         
-        task_id = f"task_{len(self.message_bus.messages)}"
+        task_id = f"task_{self.message_bus.message_count}"
         results = {}
         
         # Fase 1: Coordinatore analizza il task
         coordinator = self.agents["Coordinator"]
-        coordination_plan = coordinator.process_task(
+        coordination_plan = await coordinator.process_task_async(
             f"Analizza questo task complesso e crea un piano: {task_description}", 
             task_id
         )
         results["coordination_plan"] = coordination_plan
         
         # Fase 2: Esecuzione specializzata basata sul tipo di task
-        if any(keyword in task_description.lower() for keyword in ["calcola", "matematica", "formula"]):
+        # Ogni ramo attivato: (agente, chiave risultato, prefisso messaggio al coordinatore)
+        branches = []
+        task_lower = task_description.lower()
+        if _MATH_RE.search(task_lower):
             # Task matematico
-            math_result = self.agents["MathExpert"].process_task(task_description, task_id)
-            results["math_analysis"] = math_result
-            
-            # Invia risultato al coordinatore
-            self.agents["MathExpert"].send_message_to_agent(
-                "Coordinator", f"Calcolo completato: {math_result}", task_id
-            )
+            branches.append(("MathExpert", "math_analysis", "Calcolo completato"))
         
-        if any(keyword in task_description.lower() for keyword in ["dati", "analisi", "statistiche"]):
+        if _DATA_RE.search(task_lower):
             # Task di analisi dati
-            data_result = self.agents["DataAnalyst"].process_task(task_description, task_id)
-            results["data_analysis"] = data_result
-            
-            # Invia risultato al coordinatore
-            self.agents["DataAnalyst"].send_message_to_agent(
-                "Coordinator", f"Analisi completata: {data_result}", task_id
-            )
+            branches.append(("DataAnalyst", "data_analysis", "Analisi completata"))
         
-        if any(keyword in task_description.lower() for keyword in ["cerca", "informazioni", "ricerca"]):
+        if _RESEARCH_RE.search(task_lower):
             # Task di ricerca
-            research_result = self.agents["ResearchAgent"].process_task(task_description, task_id)
-            results["research_findings"] = research_result
+            branches.append(("ResearchAgent", "research_findings", "Ricerca completata"))
+        
+        if branches:
+            # I rami sono indipendenti e attendono la rete: eseguili in concorrenza
+            branch_results = await asyncio.gather(*(
+                self.agents[agent_name].process_task_async(task_description, task_id)
+                for agent_name, _, _ in branches
+            ))
             
-            # Invia risultato al coordinatore
-            self.agents["ResearchAgent"].send_message_to_agent(
-                "Coordinator", f"Ricerca completata: {research_result}", task_id
-            )
+            # Raccogli i risultati nell'ordine dei rami e inviali al coordinatore
+            for (agent_name, result_key, prefix), result in zip(branches, branch_results):
+                results[result_key] = result
+                self.agents[agent_name].send_message_to_agent(
+                    "Coordinator", f"{prefix}: {result}", task_id
+                )
         
         # Fase 3: Coordinatore genera report finale
         if len(results) > 1:
-            summary = "\n".join([f"{k}: {v[:100]}..." for k, v in results.items()])
-            final_report = coordinator.process_task(
+            summary = _riepilogo(results, 100)
+            final_report = await coordinator.process_task_async(
                 f"Genera un report finale per il task '{task_description}' basato su: {summary}",
                 task_id
             )
             results["final_report"] = final_report
         
+        _flush_log()
         return results
     
     def collaborative_analysis(self, data: str, research_topic: str) -> Dict[str, Any]:
         """Esempio di analisi collaborativa tra agenti"""
         
+        _flush_log()
         print(f"\n{'='*70}")
         print(f"🤝 ANALISI COLLABORATIVA")
         print(f"Dati: {data[:50]}...")
@@ -543,9 +1051,22 @@ class MultiAgentSystem:
         )
         results["synthesis"] = synthesis
         
+        _flush_log()
         return results
 
 
+# Sistema condiviso dalle demo, creato al primo utilizzo
+_SYSTEM_SINGLETON: Optional[MultiAgentSystem] = None
+
+
+def get_system() -> MultiAgentSystem:
+    """Restituisce il sistema multi-agente condiviso, creandolo se necessario"""
+    global _SYSTEM_SINGLETON
+    if _SYSTEM_SINGLETON is None:
+        _SYSTEM_SINGLETON = MultiAgentSystem()
+    return _SYSTEM_SINGLETON
+
+
 # ==============================================================================
 # DEMO E ESEMPI INTERATTIVI
 # ==============================================================================
@@ -554,7 +1075,7 @@ def demo_simple_collaboration():
     """Demo di collaborazione semplice tra agenti"""
     print_section("COLLABORAZIONE SEMPLICE")
     
-    system = MultiAgentSystem()
+    system = get_system()
     
     # Esempio 1: Task matematico
     result1 = system.execute_complex_task(
@@ -562,8 +1083,7 @@ def demo_simple_collaboration():
     )
     
     print(f"\n📊 Risultati Task 1:")
-    for key, value in result1.items():
-        print(f"   {key}: {value[:100]}...")
+    print(_riepilogo(result1, 100, indent="   "))
     
     # Esempio 2: Task di analisi dati
     result2 = system.execute_complex_task(
@@ -571,15 +1091,14 @@ def demo_simple_collaboration():
     )
     
     print(f"\n📊 Risultati Task 2:")
-    for key, value in result2.items():
-        print(f"   {key}: {value[:100]}...")
+    print(_riepilogo(result2, 100, indent="   "))
 
 
 def demo_advanced_collaboration():
     """Demo di collaborazione avanzata"""
     print_section("COLLABORAZIONE AVANZATA")
     
-    system = MultiAgentSystem()
+    system = get_system()
     
     # Analisi collaborativa complessa
     result = system.collaborative_analysis(
@@ -588,15 +1107,14 @@ def demo_advanced_collaboration():
     )
     
     print(f"\n📊 Risultati Analisi Collaborativa:")
-    for key, value in result.items():
-        print(f"   {key}: {value[:150]}...")
+    print(_riepilogo(result, 150, indent="   "))
 
 
 def demo_message_passing():
     """Demo del sistema di messaggistica tra agenti"""
     print_section("SISTEMA MESSAGGISTICA")
     
-    system = MultiAgentSystem()
+    system = get_system()
     
     # Simula scambio di messaggi
     math_agent = system.agents["MathExpert"]
@@ -615,6 +1133,7 @@ def demo_message_passing():
         "demo_task"
     )
     
+    _flush_log()
     print(f"\n📨 Risposta con contesto: {response[:200]}...")
 
 
@@ -657,6 +1176,7 @@ def run_demo(choice: str):
         try:
             demos[choice]()
         except Exception as e:
+            _flush_log()
             print(f"❌ Errore demo: {e}")
     else:
         print("❌ Opzione non valida. Scegli un numero da 0 a 5.")
@@ -671,19 +1191,18 @@ def demo_custom_task():
         print("❌ Task non inserito")
         return
     
-    system = MultiAgentSystem()
+    system = get_system()
     result = system.execute_complex_task(task)
     
     print(f"\n📊 Risultati Task Personalizzato:")
-    for key, value in result.items():
-        print(f"   {key}: {value[:200]}...")
+    print(_riepilogo(result, 200, indent="   "))
 
 
 def show_agents_info():
     """Mostra informazioni sugli agenti"""
     print_section("AGENTI DISPONIBILI")
     
-    system = MultiAgentSystem()
+    system = get_system()
     
     for name, agent in system.agents.items():
         print(f"\n🤖 {name}")
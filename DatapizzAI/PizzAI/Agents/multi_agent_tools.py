@@ -11,18 +11,55 @@ Data: 2025
 """
 
 import os
+import re
+import sys
+import atexit
+import inspect
+import ast
+import copy
 import time
-from typing import List, Dict, Any, Optional
-from dotenv import load_dotenv
+import json
+import random
+import hashlib
+import asyncio
+import operator
+import functools
+import threading
+import importlib.util
+import concurrent.futures
+from pathlib import Path
+from types import SimpleNamespace
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional, Callable, Tuple
 
-# Carica le variabili d'ambiente dal file .env nella directory parent
-load_dotenv(dotenv_path=os.path.join(os.path.dirname(__file__), '..', '.env'))
-
-# Importazioni datapizzai
-from datapizzai.clients import ClientFactory
+# Importazioni datapizzai: solo Tool serve all'import (decoratore degli strumenti);
+# ClientFactory, Memory e i tipi sono importati dalle funzioni che li usano, così
+# menu e test degli strumenti partono senza caricare l'SDK del provider
 from datapizzai.tools import Tool
-from datapizzai.memory import Memory
-from datapizzai.type import TextBlock, ROLE
+
+# NumPy e Numba sono opzionali: servono solo per il calcolo vettoriale di calcola_batch
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+# orjson è opzionale: serializzazione più veloce delle righe JSONL (batch e checkpoint)
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _riga_jsonl(obj) -> bytes:
+    """Oggetto serializzato come riga JSONL in UTF-8 (orjson se installato)"""
+    if orjson is not None:
+        return orjson.dumps(obj) + b"\n"
+    return (json.dumps(obj, ensure_ascii=False) + "\n").encode("utf-8")
 
 
 def print_section(title: str):
@@ -37,46 +74,322 @@ def print_subsection(title: str):
     print(f"\n--- {title} ---")
 
 
-def execute_tool_calls(response, available_tools):
-    """Esegue i tool call presenti nella risposta e restituisce i risultati"""
-    tool_results = []
+def _scrivi_righe(righe: List[str]):
+    """Scrive su stdout le righe raccolte in un turno con una sola write"""
+    sys.stdout.write("".join(f"{riga}\n" for riga in righe))
+    sys.stdout.flush()
+
+
+# Tool che modificano uno stato condiviso: le loro chiamate restano in ordine tra loro
+_TOOL_CON_STATO = frozenset({"gestisci_file"})
+
+
+def _tool_asincrono(tool) -> bool:
+    """True se il tool (o la funzione decorata da @Tool) è una coroutine function"""
+    return inspect.iscoroutinefunction(tool) or inspect.iscoroutinefunction(getattr(tool, "func", None))
+
+
+class WorkflowCheckpoint:
+    """Checkpoint JSONL di un workflow (risposta del modello e risultati dei tool), per riprenderlo
+    
+    La prima riga è la risposta del modello (testo e tool call): ripreso il workflow,
+    la chiamata al modello, la parte costosa, non viene ripetuta e le tool call restano
+    le stesse, quindi le chiavi sha1(query, tool, argomenti) dei risultati corrispondono.
+    Ogni risultato riuscito è aggiunto subito al file. Con riprendi=True quanto già
+    salvato viene riusato; altrimenti il file viene azzerato. I tool con stato
+    (gestisci_file) non sono salvati: il loro stato vive nel processo e va ricostruito.
+    """
+    
+    _CHIAVE_RISPOSTA = "__risposta__"
+    
+    def __init__(self, query: str, path: str = ".workflow_ckpt.jsonl", riprendi: bool = False):
+        self.query = query
+        self.path = Path(path)
+        self.risultati: Dict[str, str] = {}
+        self.risposta: Optional[Dict[str, Any]] = None
+        self.fallite = 0
+        if riprendi and self.path.exists():
+            with open(self.path, encoding="utf-8") as f:
+                for riga in f:
+                    try:
+                        voce = json.loads(riga)
+                    except ValueError:
+                        continue  # riga troncata da un'interruzione durante la scrittura
+                    if voce["key"] == self._CHIAVE_RISPOSTA:
+                        self.risposta = voce["risposta"]
+                    else:
+                        self.risultati[voce["key"]] = voce["risultato"]
+        else:
+            self.path.unlink(missing_ok=True)
+    
+    def salva_risposta(self, testo: str, response) -> SimpleNamespace:
+        """Salva testo e tool call della risposta; restituisce una risposta equivalente ricaricabile"""
+        chiamate = []
+        for block in getattr(response, "content", None) or ():
+            tool_name = getattr(block, "name", None)
+            arguments = getattr(block, "arguments", None)
+            if tool_name is not None and arguments is not None:
+                chiamate.append({"name": tool_name, "arguments": arguments})
+        self.risposta = {"testo": testo, "chiamate": chiamate}
+        with open(self.path, "ab") as f:
+            f.write(_riga_jsonl({"key": self._CHIAVE_RISPOSTA, "risposta": self.risposta}))
+        return self.risposta_salvata()
+    
+    def risposta_salvata(self) -> Optional[SimpleNamespace]:
+        """Risposta del modello ricostruita dal checkpoint (text e blocchi name/arguments), o None"""
+        if self.risposta is None:
+            return None
+        return SimpleNamespace(
+            text=self.risposta["testo"],
+            content=[SimpleNamespace(**chiamata) for chiamata in self.risposta["chiamate"]]
+        )
     
+    def chiave(self, tool_name: str, arguments: Dict[str, Any]) -> str:
+        dati = json.dumps([self.query, tool_name, arguments], sort_keys=True, default=str)
+        return hashlib.sha1(dati.encode("utf-8")).hexdigest()
+    
+    def salva(self, chiave: str, risultato: str):
+        self.risultati[chiave] = risultato
+        with open(self.path, "ab") as f:
+            f.write(_riga_jsonl({"key": chiave, "risultato": risultato}))
+    
+    def completa(self) -> bool:
+        """Workflow concluso: rimuove il checkpoint solo se nessun tool è fallito"""
+        if self.fallite:
+            return False
+        self.path.unlink(missing_ok=True)
+        return True
+
+
+async def execute_tool_calls_async(response, available_tools, checkpoint: Optional[WorkflowCheckpoint] = None):
+    """Esegue in concorrenza i tool call presenti nella risposta e restituisce i risultati in ordine
+    
+    Le chiamate ai tool senza stato (calcola, cerca_informazioni) girano in parallelo: i tool
+    sincroni in thread separati, quelli asincroni direttamente nell'event loop. Le chiamate a
+    gestisci_file sono eseguite in sequenza, così un "list" richiesto dopo un "create" vede il
+    file appena creato. Le chiamate senza stato ripetute con gli stessi argomenti (capita con
+    le tool call parallele) sono eseguite una volta sola.
+    """
+    # Solo i tool legati al client: un nome fuori da questo set non viene eseguito
+    strumenti = {tool.name: tool for tool in available_tools or ()}
+    chiamate = []
     for block in response.content:
-        if hasattr(block, 'name') and hasattr(block, 'arguments'):
-            tool_name = block.name
-            arguments = block.arguments
-            
-            print(f"   🔧 Strumento usato: {tool_name}")
-            print(f"   📋 Argomenti: {arguments}")
-            
-            # Mappa dei tool disponibili
-            tool_map = {
-                "calcola": calcola,
-                "cerca_informazioni": cerca_informazioni,
-                "gestisci_file": gestisci_file
-            }
-            
-            if tool_name in tool_map:
-                try:
-                    result = tool_map[tool_name](**arguments)
-                    tool_results.append(result)
-                    print(f"   ✅ Risultato: {result}")
-                except Exception as e:
-                    error_msg = f"Errore nell'esecuzione del tool {tool_name}: {e}"
-                    tool_results.append(error_msg)
-                    print(f"   ❌ {error_msg}")
+        # Un solo getattr per attributo: i blocchi di testo non hanno name/arguments
+        tool_name = getattr(block, 'name', None)
+        arguments = getattr(block, 'arguments', None)
+        if tool_name is None or arguments is None:
+            continue
+        print(f"   🔧 Strumento usato: {tool_name}")
+        print(f"   📋 Argomenti: {arguments}")
+        chiamate.append((tool_name, arguments))
+    
+    # (successo, testo) per ogni chiamata, nella posizione del blocco che l'ha richiesta
+    esiti: List[Optional[Tuple[bool, str]]] = [None] * len(chiamate)
+    
+    async def esegui(indice: int):
+        tool_name, arguments = chiamate[indice]
+        tool = strumenti.get(tool_name)
+        if tool is None:
+            esiti[indice] = (False, f"Tool {tool_name} non riconosciuto")
+            if checkpoint is not None:
+                checkpoint.fallite += 1
+            return
+        chiave = None
+        if checkpoint is not None and tool_name not in _TOOL_CON_STATO:
+            chiave = checkpoint.chiave(tool_name, arguments)
+            if chiave in checkpoint.risultati:
+                print(f"   ♻️ {tool_name}: risultato ripreso dal checkpoint")
+                esiti[indice] = (True, checkpoint.risultati[chiave])
+                return
+        try:
+            if _tool_asincrono(tool):
+                risultato = await tool(**arguments)
             else:
-                error_msg = f"Tool {tool_name} non riconosciuto"
-                tool_results.append(error_msg)
-                print(f"   ❌ {error_msg}")
+                risultato = await asyncio.to_thread(tool, **arguments)
+            esiti[indice] = (True, risultato)
+            if chiave is not None:
+                checkpoint.salva(chiave, risultato)
+        except Exception as e:
+            esiti[indice] = (False, f"Errore nell'esecuzione del tool {tool_name}: {e}")
+            if checkpoint is not None:
+                checkpoint.fallite += 1
+    
+    con_stato = []
+    # (nome, argomenti serializzati) -> indici delle chiamate identiche; esegue la prima
+    senza_stato: Dict[Tuple[str, str], List[int]] = {}
+    for i, (tool_name, arguments) in enumerate(chiamate):
+        if tool_name in _TOOL_CON_STATO:
+            con_stato.append(i)
+        else:
+            chiave = (tool_name, json.dumps(arguments, sort_keys=True, default=str))
+            senza_stato.setdefault(chiave, []).append(i)
+    
+    async def esegui_in_ordine():
+        for indice in con_stato:
+            await esegui(indice)
+    
+    await asyncio.gather(
+        esegui_in_ordine(),
+        *(esegui(indici[0]) for indici in senza_stato.values())
+    )
+    for indici in senza_stato.values():
+        for duplicato in indici[1:]:
+            esiti[duplicato] = esiti[indici[0]]
+    
+    tool_results = []
+    for successo, testo in esiti:
+        tool_results.append(testo)
+        print(f"   ✅ Risultato: {testo}" if successo else f"   ❌ {testo}")
     
     return tool_results
 
 
+def execute_tool_calls(response, available_tools, checkpoint: Optional[WorkflowCheckpoint] = None):
+    """Esegue i tool call presenti nella risposta e restituisce i risultati
+    
+    Chiamata da dentro un event loop già attivo (notebook, codice async), esegue il
+    workflow in un thread separato: asyncio.run non può annidarsi nel loop corrente.
+    """
+    coro = execute_tool_calls_async(response, available_tools, checkpoint)
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coro)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(asyncio.run, coro).result()
+
+
 # ==============================================================================
 # DEFINIZIONE STRUMENTI (TOOLS)
 # ==============================================================================
 
+# Tabella che elimina i caratteri ammessi: se dopo translate resta qualcosa, l'input non è valido
+_CARATTERI_NON_AMMESSI = str.maketrans('', '', '0123456789+-*/(). ')
+
+# Operatori ammessi nelle espressioni di calcola
+_OPERATORI_BINARI = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.Div: operator.truediv,
+    ast.FloorDiv: operator.floordiv,
+    ast.Pow: operator.pow,
+}
+_OPERATORI_UNARI = {
+    ast.UAdd: operator.pos,
+    ast.USub: operator.neg,
+}
+
+
+@functools.lru_cache(maxsize=1024)
+def _parse_espressione(espressione: str) -> ast.expr:
+    """Analizza l'espressione una sola volta e ne riusa l'albero"""
+    return ast.parse(espressione, mode="eval").body
+
+
+def _valuta_nodo(nodo: ast.expr, variabili: Optional[Dict[str, Any]] = None):
+    """Valuta un albero aritmetico: solo numeri, operatori e (per calcola_batch) variabili note"""
+    if isinstance(nodo, ast.Constant) and isinstance(nodo.value, (int, float)):
+        return nodo.value
+    if isinstance(nodo, ast.BinOp) and type(nodo.op) in _OPERATORI_BINARI:
+        return _OPERATORI_BINARI[type(nodo.op)](_valuta_nodo(nodo.left, variabili), _valuta_nodo(nodo.right, variabili))
+    if isinstance(nodo, ast.UnaryOp) and type(nodo.op) in _OPERATORI_UNARI:
+        return _OPERATORI_UNARI[type(nodo.op)](_valuta_nodo(nodo.operand, variabili))
+    if isinstance(nodo, ast.Name) and variabili is not None and nodo.id in variabili:
+        return variabili[nodo.id]
+    raise ValueError("espressione non valida")
+
+
+def _valida_nodo(nodo: ast.expr, nomi: Tuple[str, ...]):
+    """Controlla che l'albero contenga solo i nodi ammessi da _valuta_nodo, senza valutarlo"""
+    if isinstance(nodo, ast.Constant) and isinstance(nodo.value, (int, float)):
+        return
+    if isinstance(nodo, ast.BinOp) and type(nodo.op) in _OPERATORI_BINARI:
+        _valida_nodo(nodo.left, nomi)
+        _valida_nodo(nodo.right, nomi)
+        return
+    if isinstance(nodo, ast.UnaryOp) and type(nodo.op) in _OPERATORI_UNARI:
+        _valida_nodo(nodo.operand, nomi)
+        return
+    if isinstance(nodo, ast.Name) and nodo.id in nomi:
+        return
+    raise ValueError("espressione non valida")
+
+
+# Sotto questa dimensione il costo di dispatch del kernel compilato non si ripaga
+_NUMBA_MIN_SIZE = 1000
+
+# Kernel compilati per (espressione, nomi delle variabili)
+_KERNEL_BATCH: Dict[Tuple[str, Tuple[str, ...]], Callable] = {}
+
+
+class _RinominaVariabili(ast.NodeTransformer):
+    """Sostituisce i nomi delle variabili con gli argomenti del kernel generato"""
+    
+    def __init__(self, rinomina: Dict[str, str]):
+        self.rinomina = rinomina
+    
+    def visit_Name(self, nodo: ast.Name) -> ast.Name:
+        return ast.Name(id=self.rinomina[nodo.id], ctx=ast.Load())
+
+
+def _kernel_batch(espressione: str, nomi: Tuple[str, ...]) -> Callable:
+    """Compila con Numba una funzione che valuta l'espressione sugli array delle variabili"""
+    chiave = (espressione, nomi)
+    kernel = _KERNEL_BATCH.get(chiave)
+    if kernel is None:
+        # Copia: l'albero in cache di _parse_espressione è condiviso con il calcolo scalare
+        albero = copy.deepcopy(_parse_espressione(espressione))
+        # Valida l'albero (stessi nodi ammessi dal calcolo scalare) prima di generare codice
+        _valida_nodo(albero, nomi)
+        # Le variabili diventano argomenti posizionali v0, v1, ...: nel sorgente generato
+        # non compare alcun nome scelto dall'utente
+        rinomina = {nome: f"v{i}" for i, nome in enumerate(nomi)}
+        corpo = ast.unparse(_RinominaVariabili(rinomina).visit(albero))
+        namespace: Dict[str, Any] = {}
+        exec(f"def _f({', '.join(rinomina.values())}):\n    return {corpo}", namespace)
+        kernel = _KERNEL_BATCH[chiave] = njit(namespace["_f"])
+    return kernel
+
+
+def calcola_batch(espressione: str, variabili: Dict[str, Any]):
+    """Valuta la stessa espressione su molti valori (es: "x * 1.22 + y" con x, y array)
+    
+    Con Numba e array abbastanza grandi l'espressione viene compilata in codice nativo
+    una volta sola e riusata; altrimenti è valutata con NumPy (o elemento per elemento).
+    """
+    nomi = tuple(sorted(variabili))
+    
+    if np is None:
+        # Senza NumPy: valutazione scalare per ogni n-upla di valori
+        colonne = [variabili[nome] for nome in nomi]
+        albero = _parse_espressione(espressione)
+        return [_valuta_nodo(albero, dict(zip(nomi, valori))) for valori in zip(*colonne)]
+    
+    array = [np.asarray(variabili[nome], dtype=np.float64) for nome in nomi]
+    if njit is not None and array and array[0].size >= _NUMBA_MIN_SIZE:
+        return _kernel_batch(espressione, nomi)(*array)
+    return _valuta_nodo(_parse_espressione(espressione), dict(zip(nomi, array)))
+
+
+# I risultati dei tool sono deterministici: le chiamate ripetute con gli stessi
+# argomenti (frequenti nelle conversazioni multi-turno) vengono servite dalla cache
+
+@functools.lru_cache(maxsize=512)
+def _calcola(espressione: str) -> str:
+    """Calcolo effettivo, memorizzato per espressione"""
+    # Valida input (solo operazioni matematiche sicure)
+    if espressione.translate(_CARATTERI_NON_AMMESSI):
+        return "Errore: Caratteri non permessi. Usa solo numeri e operatori +-*/()"
+    
+    # Esegue il calcolo sull'albero sintattico (niente eval)
+    try:
+        result = _valuta_nodo(_parse_espressione(espressione))
+    except Exception as e:
+        return f"Errore nel calcolo: {str(e)}"
+    return f"Risultato: {result}"
+
+
 @Tool
 def calcola(espressione: str) -> str:
     """Esegue calcoli matematici sicuri.
@@ -87,18 +400,65 @@ def calcola(espressione: str) -> str:
     Returns:
         Risultato del calcolo
     """
+    return _calcola(espressione)
+
+
+# Parola chiave -> categoria di risultati della ricerca simulata
+_CATEGORIE_RICERCA = {
+    "python": "python",
+    "artificial intelligence": "ai",
+    "ai": "ai",
+}
+
+# Tutte le parole chiave in un'unica regex case-insensitive: una sola scansione della query
+_CATEGORIE_RE = re.compile(
+    "|".join(re.escape(k) for k in sorted(_CATEGORIE_RICERCA, key=len, reverse=True)),
+    re.IGNORECASE
+)
+
+
+def _elenco(righe: List[str]) -> str:
+    """Formatta le righe come elenco puntato"""
+    return "\n".join(f"- {r}" for r in righe)
+
+
+# Risultati simulati per categoria, già formattati: a ogni ricerca resta solo il prefisso
+_RISULTATI_RICERCA = {
+    "python": _elenco([
+        "Python è un linguaggio di programmazione interpretato",
+        "Guida ufficiale Python: python.org",
+        "Tutorial Python per principianti disponibili online"
+    ]),
+    "ai": _elenco([
+        "L'Intelligenza Artificiale è un campo dell'informatica",
+        "Machine Learning è un sottoinsieme dell'AI",
+        "Applicazioni AI: riconoscimento immagini, NLP, robotica"
+    ]),
+}
+_RISULTATI_DEFAULT = _elenco([
+    "Questo è un simulatore di ricerca web",
+    "In un ambiente reale, qui ci sarebbero risultati reali"
+])
+
+
+@functools.lru_cache(maxsize=512)
+def _cerca_informazioni(query: str) -> str:
+    """Ricerca simulata effettiva, memorizzata per query"""
     try:
-        # Valida input (solo operazioni matematiche sicure)
-        allowed_chars = set('0123456789+-*/(). ')
-        if not all(c in allowed_chars for c in espressione):
-            return "Errore: Caratteri non permessi. Usa solo numeri e operatori +-*/()"
+        # Simula ricerca web con risultati fittizi
+        categorie = {_CATEGORIE_RICERCA[m.group(0).lower()] for m in _CATEGORIE_RE.finditer(query)}
         
-        # Esegue il calcolo
-        result = eval(espressione)
-        return f"Risultato: {result}"
+        if "python" in categorie:
+            risultati = _RISULTATI_RICERCA["python"]
+        elif "ai" in categorie:
+            risultati = _RISULTATI_RICERCA["ai"]
+        else:
+            risultati = f"- Risultati per '{query}' non disponibili in questa demo\n{_RISULTATI_DEFAULT}"
+        
+        return f"Risultati ricerca per '{query}':\n{risultati}"
         
     except Exception as e:
-        return f"Errore nel calcolo: {str(e)}"
+        return f"Errore nella ricerca: {str(e)}"
 
 
 @Tool
@@ -111,42 +471,25 @@ def cerca_informazioni(query: str) -> str:
     Returns:
         Risultati della ricerca simulata
     """
-    try:
-        # Simula ricerca web con risultati fittizi
-        query_lower = query.lower()
-        
-        if "python" in query_lower:
-            results = [
-                "Python è un linguaggio di programmazione interpretato",
-                "Guida ufficiale Python: python.org",
-                "Tutorial Python per principianti disponibili online"
-            ]
-        elif "ai" in query_lower or "artificial intelligence" in query_lower:
-            results = [
-                "L'Intelligenza Artificiale è un campo dell'informatica",
-                "Machine Learning è un sottoinsieme dell'AI",
-                "Applicazioni AI: riconoscimento immagini, NLP, robotica"
-            ]
-        else:
-            results = [
-                f"Risultati per '{query}' non disponibili in questa demo",
-                "Questo è un simulatore di ricerca web",
-                "In un ambiente reale, qui ci sarebbero risultati reali"
-            ]
-        
-        return f"Risultati ricerca per '{query}':\n" + "\n".join(f"- {r}" for r in results)
-        
-    except Exception as e:
-        return f"Errore nella ricerca: {str(e)}"
+    return _cerca_informazioni(query)
 
 
-# Sistema di file simulato globale
-FILES_SYSTEM = {
-    "docs/": ["README.md", "guide.txt"],
-    "src/": ["main.py", "utils.py"],
-    "data/": ["dataset.csv", "config.json"]
+# Sistema di file simulato globale: per ogni directory un dict usato come insieme
+# ordinato (ricerca e rimozione O(1), niente duplicati, ordine di creazione preservato)
+FILES_SYSTEM: Dict[str, Dict[str, None]] = {
+    "docs/": dict.fromkeys(["README.md", "guide.txt"]),
+    "src/": dict.fromkeys(["main.py", "utils.py"]),
+    "data/": dict.fromkeys(["dataset.csv", "config.json"])
 }
 
+# Risultati di "list" per directory, invalidati da create/delete sulla stessa directory
+_LISTING_CACHE: Dict[str, str] = {}
+
+# execute_tool_calls esegue i tool in thread separati: il lock rende atomici
+# lettura/aggiornamento di FILES_SYSTEM e della cache dei listing
+_FILES_LOCK = threading.Lock()
+
+
 @Tool
 def gestisci_file(comando: str, percorso: str) -> str:
     """Gestisce file e directory in un sistema simulato.
@@ -158,41 +501,46 @@ def gestisci_file(comando: str, percorso: str) -> str:
     Returns:
         Risultato dell'operazione
     """
+    with _FILES_LOCK:
+        return _gestisci_file(comando, percorso)
+
+
+def _gestisci_file(comando: str, percorso: str) -> str:
+    """Operazione effettiva sul file system simulato (da chiamare con _FILES_LOCK acquisito)"""
     try:
         global FILES_SYSTEM
         
         if comando == "list":
+            if percorso in _LISTING_CACHE:
+                return _LISTING_CACHE[percorso]
             if percorso in FILES_SYSTEM:
                 files_list = FILES_SYSTEM[percorso]
-                return f"Contenuto di {percorso}:\n" + "\n".join(f"- {f}" for f in files_list)
+                listing = f"Contenuto di {percorso}:\n" + "\n".join(f"- {f}" for f in files_list)
+                _LISTING_CACHE[percorso] = listing
+                return listing
             else:
                 return f"Directory {percorso} non trovata"
         
         elif comando == "create":
             # Simula creazione file
-            filename = percorso.split("/")[-1] if "/" in percorso else percorso
-            directory = "/".join(percorso.split("/")[:-1]) + "/" if "/" in percorso else ""
+            head, sep, filename = percorso.rpartition("/")
+            directory = head + sep
             
-            if directory and directory not in FILES_SYSTEM:
-                FILES_SYSTEM[directory] = []
-            
-            if directory:
-                FILES_SYSTEM[directory].append(filename)
-            else:
-                if "root/" not in FILES_SYSTEM:
-                    FILES_SYSTEM["root/"] = []
-                FILES_SYSTEM["root/"].append(filename)
+            directory = directory or "root/"
+            FILES_SYSTEM.setdefault(directory, {})[filename] = None
+            _LISTING_CACHE.pop(directory, None)
             
             return f"File {filename} creato con successo"
         
         elif comando == "delete":
             # Simula eliminazione file
-            filename = percorso.split("/")[-1] if "/" in percorso else percorso
-            directory = "/".join(percorso.split("/")[:-1]) + "/" if "/" in percorso else ""
+            head, sep, filename = percorso.rpartition("/")
+            directory = head + sep
             
             if directory and directory in FILES_SYSTEM:
                 if filename in FILES_SYSTEM[directory]:
-                    FILES_SYSTEM[directory].remove(filename)
+                    del FILES_SYSTEM[directory][filename]
+                    _LISTING_CACHE.pop(directory, None)
                     return f"File {filename} eliminato con successo"
             
             return f"File {percorso} non trovato"
@@ -204,20 +552,84 @@ def gestisci_file(comando: str, percorso: str) -> str:
         return f"Errore nella gestione file: {str(e)}"
 
 
+def _ordina_tools(*tools) -> list:
+    """Lista di tool ordinata per nome: lo schema serializzato è identico a ogni richiesta"""
+    return sorted(tools, key=operator.attrgetter("name"))
+
+
+# Set di strumenti usati dalle demo: gli schemi sono generati da @Tool una volta sola
+# all'import e le liste (da non modificare) sono condivise tra tutte le esecuzioni.
+# L'ordine stabile mantiene invariato il prefisso system+tools, che il provider può
+# così riusare dalla cache dei prompt invece di rielaborarlo a ogni query
+TOOLS_CALCOLO = _ordina_tools(calcola)
+TOOLS_RICERCA = _ordina_tools(cerca_informazioni, gestisci_file)
+TOOLS_TUTTI = _ordina_tools(calcola, cerca_informazioni, gestisci_file)
+
+
 # ==============================================================================
 # CREAZIONE CLIENT CON STRUMENTI
 # ==============================================================================
 
-def create_calculator_client():
-    """Crea un client specializzato in calcoli matematici"""
+# System prompt dei client usati dalle demo, per ruolo
+SYSTEM_PROMPTS = {
+    "calculator": """Sei un assistente specializzato in calcoli matematici. 
+        Usa sempre lo strumento calcola per eseguire calcoli.
+        Fornisci risposte precise e spiega i passaggi quando possibile.""",
+    "research": """Sei un assistente di ricerca e analisi. 
+        Usa cerca_informazioni per cercare informazioni e gestisci_file per gestire file.
+        Organizza le informazioni in modo chiaro e strutturato.""",
+    "multi_tool": """Sei un assistente versatile con accesso a molteplici strumenti.
+        Hai a disposizione:
+        - calcola: per calcoli matematici
+        - cerca_informazioni: per ricerche web simulate
+        - gestisci_file: per gestione file e directory
+        
+        Analizza la richiesta dell'utente e scegli lo strumento più appropriato.
+        Se necessario, combina più strumenti per completare task complessi.
+        Spiega sempre quale strumento stai usando e perché.""",
+    "summary": """Riassumi in modo conciso le conversazioni che ricevi.
+        Conserva nomi, obiettivi, numeri e risultati degli strumenti: serviranno nei turni successivi.""",
+    "facts": """Estrai dal dialogo i fatti atomici e duraturi sull'utente e sul suo lavoro
+        (nome, progetto, cifre, file creati). Rispondi solo con una lista JSON di stringhe brevi,
+        oppure [] se non ci sono fatti nuovi."""
+}
+
+# Modello per ruolo (default gpt-4o): riassunti ed estrazione fatti usano un modello più piccolo
+_MODELLI_RUOLO = {"summary": "gpt-4o-mini", "facts": "gpt-4o-mini"}
+
+@functools.lru_cache(maxsize=None)
+def _load_env():
+    """Carica le variabili d'ambiente dal file .env nella directory parent (una sola volta)"""
+    if not os.environ.get("OPENAI_API_KEY"):
+        from dotenv import load_dotenv
+        load_dotenv(dotenv_path=os.path.join(os.path.dirname(__file__), '..', '.env'))
+
+
+# Client già creati, per ruolo: le demo successive del menu li riusano
+_CLIENT_POOL: Dict[str, Any] = {}
+_CLIENT_POOL_LOCK = threading.Lock()
+
+# Ruoli delle demo le cui risposte passano dalla cache semantica
+# (riassunti ed estrazione fatti dipendono dall'intero dialogo e restano esclusi)
+_RUOLI_CACHE_SEMANTICA = frozenset({"calculator", "research", "multi_tool"})
+
+# La cache semantica è opzionale (DATAPIZZAI_SEMANTIC_CACHE=1): ogni richiesta non in
+# cache esatta paga una chiamata di embedding in più prima di quella al modello
+_CACHE_SEMANTICA_ATTIVA = os.getenv("DATAPIZZAI_SEMANTIC_CACHE") == "1"
+
+
+def _make_client(system_prompt: str, model: str = "gpt-4o"):
+    """Crea un client OpenAI con il system prompt dato"""
+    from datapizzai.clients import ClientFactory
+    from datapizzai.cache import MemoryCache
     
+    _load_env()
     client = ClientFactory.create(
         provider="openai",
         api_key=os.getenv("OPENAI_API_KEY"),
-        model="gpt-4o",
-        system_prompt="""Sei un assistente specializzato in calcoli matematici. 
-        Usa sempre lo strumento calcola per eseguire calcoli.
-        Fornisci risposte precise e spiega i passaggi quando possibile."""
+        model=model,
+        system_prompt=system_prompt,
+        cache=MemoryCache()  # L1: richieste identiche byte per byte
     )
     
     if not client:
@@ -226,93 +638,336 @@ def create_calculator_client():
     return client
 
 
+def get_client(ruolo: str):
+    """Restituisce il client del ruolo dal pool, creandolo al primo utilizzo"""
+    client = _CLIENT_POOL.get(ruolo)
+    if client is None:
+        with _CLIENT_POOL_LOCK:
+            client = _CLIENT_POOL.get(ruolo)
+            if client is None:
+                client = _make_client(SYSTEM_PROMPTS[ruolo], _MODELLI_RUOLO.get(ruolo, "gpt-4o"))
+                if _CACHE_SEMANTICA_ATTIVA and ruolo in _RUOLI_CACHE_SEMANTICA:
+                    client = SemanticCache(client)
+                client = _CLIENT_POOL[ruolo] = client
+    return client
+
+
+def warmup_clients() -> concurrent.futures.Future:
+    """Crea in background i client del pool (import SDK, configurazione) mentre l'utente legge il menu"""
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="warmup")
+    future = executor.submit(lambda: [get_client(ruolo) for ruolo in SYSTEM_PROMPTS])
+    executor.shutdown(wait=False)
+    return future
+
+
+@atexit.register
+def _close_client_pool():
+    """Chiude i client del pool all'uscita (se il client espone close)"""
+    for client in _CLIENT_POOL.values():
+        close = getattr(client, "close", None)
+        if callable(close):
+            try:
+                close()
+            except Exception:
+                pass
+    _CLIENT_POOL.clear()
+
+
+def create_calculator_client():
+    """Crea un client specializzato in calcoli matematici"""
+    return get_client("calculator")
+
+
 def create_research_client():
     """Crea un client specializzato in ricerche e analisi"""
+    return get_client("research")
+
+
+def create_multi_tool_client():
+    """Crea un client con accesso a tutti gli strumenti"""
+    return get_client("multi_tool")
+
+
+class ClientConTools:
+    """Client con il set di tool fissato una volta sola (vedi bind_tools)
     
-    client = ClientFactory.create(
-        provider="openai",
-        api_key=os.getenv("OPENAI_API_KEY"),
-        model="gpt-4o",
-        system_prompt="""Sei un assistente di ricerca e analisi. 
-        Usa cerca_informazioni per cercare informazioni e gestisci_file per gestire file.
-        Organizza le informazioni in modo chiaro e strutturato."""
-    )
+    invoke e a_invoke passano sempre la stessa lista di tool per riferimento: niente
+    liste ricostruite a ogni richiesta e porzione tools della richiesta sempre identica.
+    """
     
-    if not client:
-        raise ValueError("Client OpenAI non disponibile")
+    def __init__(self, client, tools):
+        self.client = client
+        self.tools = _ordina_tools(*tools)
     
-    return client
+    def __getattr__(self, nome):
+        return getattr(self.client, nome)
+    
+    def invoke(self, input, tools=None, tool_choice: str = "auto", **kwargs):
+        return self.client.invoke(input=input, tools=tools or self.tools, tool_choice=tool_choice, **kwargs)
+    
+    async def a_invoke(self, input, tools=None, tool_choice: str = "auto", **kwargs):
+        return await self.client.a_invoke(input=input, tools=tools or self.tools, tool_choice=tool_choice, **kwargs)
+    
+    def stream_invoke(self, input, tools=None, tool_choice: str = "auto", **kwargs):
+        return self.client.stream_invoke(input=input, tools=tools or self.tools, tool_choice=tool_choice, **kwargs)
 
 
-def create_multi_tool_client():
-    """Crea un client con accesso a tutti gli strumenti"""
+def bind_tools(client, tools) -> ClientConTools:
+    """Lega un set di tool al client: le chiamate successive non devono più passarli"""
+    return ClientConTools(client, tools)
+
+
+_NUMERI_RE = re.compile(r"\d+(?:[.,]\d+)?")
+
+
+@functools.lru_cache(maxsize=1)
+def _openai_installato() -> bool:
+    """True se l'SDK OpenAI è installato (senza importarlo)"""
+    return importlib.util.find_spec("openai") is not None
+
+
+class SemanticCache:
+    """Cache semantica (L2) delle risposte attorno a invoke/a_invoke
     
-    client = ClientFactory.create(
-        provider="openai",
-        api_key=os.getenv("OPENAI_API_KEY"),
-        model="gpt-4o",
-        system_prompt="""Sei un assistente versatile con accesso a molteplici strumenti.
-        Hai a disposizione:
-        - calcola: per calcoli matematici
-        - cerca_informazioni: per ricerche web simulate
-        - gestisci_file: per gestione file e directory
-        
-        Analizza la richiesta dell'utente e scegli lo strumento più appropriato.
-        Se necessario, combina più strumenti per completare task complessi.
-        Spiega sempre quale strumento stai usando e perché."""
-    )
+    Sulle richieste già viste a meno della formulazione restituisce la risposta in
+    cache senza chiamare il modello: la query è confrontata per similarità coseno
+    (embedding text-embedding-3-small) con le precedenti che hanno lo stesso contesto,
+    cioè stessi tool, ultimi turni di memoria e numeri citati ("15 + 27" e "15 + 28"
+    sono vicinissime come testo ma non sono la stessa domanda). Le voci scadono dopo
+    ttl secondi e oltre max_voci si scarta la meno usata. Senza NumPy o SDK OpenAI
+    resta attiva solo la cache esatta (L1) del client; se il calcolo dell'embedding
+    fallisce la richiesta va direttamente al modello. Le demo la usano solo con
+    DATAPIZZAI_SEMANTIC_CACHE=1.
+    """
     
-    if not client:
-        raise ValueError("Client OpenAI non disponibile")
+    def __init__(self, client, soglia: float = 0.95, max_voci: int = 256,
+                 ttl: float = 3600, turni_contesto: int = 4):
+        self.client = client
+        self.soglia = soglia
+        self.max_voci = max_voci
+        self.ttl = ttl
+        self.turni_contesto = turni_contesto
+        self.hit = 0
+        self._voci: OrderedDict = OrderedDict()  # (contesto, query) -> (contesto, vettore, risposta, scadenza)
+        self._lock = threading.Lock()
+        self._embedder = None
     
-    return client
+    def __getattr__(self, nome):
+        # close, stream_invoke, ... sono quelli del client originale
+        return getattr(self.client, nome)
+    
+    @property
+    def attiva(self) -> bool:
+        return np is not None and _openai_installato()
+    
+    def _contesto(self, input, tools, tool_choice, memory) -> Tuple:
+        turni = []
+        if memory is not None:
+            for turno in list(memory.memory)[-self.turni_contesto:]:
+                turni.append(tuple(str(getattr(blocco, "content", blocco))
+                                   for blocco in getattr(turno, "blocks", ())))
+        return (
+            tuple(tool.name for tool in tools or ()),
+            tool_choice,
+            hash(tuple(turni)),
+            tuple(_NUMERI_RE.findall(str(input))),
+        )
+    
+    def _embedding(self, testo: str):
+        if self._embedder is None:
+            import openai  # solo qui: il menu e i tool non pagano l'import dell'SDK
+            self._embedder = openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+        dati = self._embedder.embeddings.create(model="text-embedding-3-small", input=testo).data
+        vettore = np.asarray(dati[0].embedding, dtype=np.float32)
+        return vettore / np.linalg.norm(vettore)
+    
+    def _cerca(self, contesto: Tuple, query: str, vettore):
+        """Risposta in cache per la query (esatta o simile oltre soglia), altrimenti None"""
+        adesso = time.monotonic()
+        with self._lock:
+            for chiave in [k for k, voce in self._voci.items() if voce[3] < adesso]:
+                del self._voci[chiave]
+            voce = self._voci.get((contesto, query))
+            if voce is None and vettore is not None:
+                candidati = [(k, v) for k, v in self._voci.items() if v[0] == contesto]
+                if candidati:
+                    simili = np.stack([v[1] for _, v in candidati]) @ vettore
+                    migliore = int(simili.argmax())
+                    if simili[migliore] > self.soglia:
+                        voce = candidati[migliore][1]
+                        query = candidati[migliore][0][1]
+            if voce is None:
+                return None
+            self._voci.move_to_end((contesto, query))
+            self.hit += 1
+            return voce[2]
+    
+    def _salva(self, contesto: Tuple, query: str, vettore, risposta):
+        with self._lock:
+            self._voci[(contesto, query)] = (contesto, vettore, risposta, time.monotonic() + self.ttl)
+            self._voci.move_to_end((contesto, query))
+            while len(self._voci) > self.max_voci:
+                self._voci.popitem(last=False)
+    
+    def invoke(self, input, tools=None, tool_choice: str = "auto", memory=None, **kwargs):
+        if not self.attiva or not input or not isinstance(input, str):
+            return self.client.invoke(input=input, tools=tools, tool_choice=tool_choice, memory=memory, **kwargs)
+        contesto = self._contesto(input, tools, tool_choice, memory)
+        risposta = self._cerca(contesto, input, None)
+        if risposta is not None:
+            return risposta
+        try:
+            vettore = self._embedding(input)
+        except Exception:
+            # Embedding non disponibile (rete, chiave, quota): si chiama il modello senza cache
+            return self.client.invoke(input=input, tools=tools, tool_choice=tool_choice, memory=memory, **kwargs)
+        risposta = self._cerca(contesto, input, vettore)
+        if risposta is None:
+            risposta = self.client.invoke(input=input, tools=tools, tool_choice=tool_choice, memory=memory, **kwargs)
+            self._salva(contesto, input, vettore, risposta)
+        return risposta
+    
+    async def a_invoke(self, input, tools=None, tool_choice: str = "auto", memory=None, **kwargs):
+        if not self.attiva or not input or not isinstance(input, str):
+            return await self.client.a_invoke(input=input, tools=tools, tool_choice=tool_choice, memory=memory, **kwargs)
+        contesto = self._contesto(input, tools, tool_choice, memory)
+        risposta = self._cerca(contesto, input, None)
+        if risposta is not None:
+            return risposta
+        try:
+            vettore = await asyncio.to_thread(self._embedding, input)
+        except Exception:
+            return await self.client.a_invoke(input=input, tools=tools, tool_choice=tool_choice, memory=memory, **kwargs)
+        risposta = self._cerca(contesto, input, vettore)
+        if risposta is None:
+            risposta = await self.client.a_invoke(input=input, tools=tools, tool_choice=tool_choice, memory=memory, **kwargs)
+            self._salva(contesto, input, vettore, risposta)
+        return risposta
+
+
+class LimitatoreRichieste:
+    """Token bucket asincrono: al massimo rpm richieste al minuto, con burst fino a burst"""
+    
+    def __init__(self, rpm: int, burst: Optional[int] = None):
+        self.ritmo = rpm / 60
+        self.capacita = burst or max(1, rpm // 10)
+        self._token = float(self.capacita)
+        self._ultimo = time.monotonic()
+    
+    async def acquire(self):
+        """Attende un token (senza lock: lavora su un solo event loop alla volta)"""
+        while True:
+            adesso = time.monotonic()
+            self._token = min(self.capacita, self._token + (adesso - self._ultimo) * self.ritmo)
+            self._ultimo = adesso
+            if self._token >= 1:
+                self._token -= 1
+                return
+            await asyncio.sleep((1 - self._token) / self.ritmo)
+
+
+# Limite condiviso dalle richieste concorrenti delle demo (RPM del proprio tier OpenAI)
+_LIMITATORE = LimitatoreRichieste(int(os.getenv("DATAPIZZAI_RPM", "500")))
+_MAX_TENTATIVI = 6
+
+
+def _is_rate_limit(errore: Exception) -> bool:
+    return getattr(errore, "status_code", None) == 429 or type(errore).__name__ == "RateLimitError"
+
+
+def _attesa_retry(errore: Exception, tentativo: int) -> float:
+    """Secondi di attesa prima del nuovo tentativo: Retry-After se presente, altrimenti backoff esponenziale con jitter"""
+    headers = getattr(getattr(errore, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return random.uniform(1, min(30, 2 ** (tentativo + 1)))
+
+
+async def _a_invoke_con_backoff(client, **kwargs):
+    """a_invoke rispettando il rate limit e ripetendo la richiesta sugli errori 429"""
+    for tentativo in range(_MAX_TENTATIVI):
+        await _LIMITATORE.acquire()
+        try:
+            return await client.a_invoke(**kwargs)
+        except Exception as e:
+            if tentativo == _MAX_TENTATIVI - 1 or not _is_rate_limit(e):
+                raise
+            await asyncio.sleep(_attesa_retry(e, tentativo))
+
+
+# Richieste al modello in volo contemporaneamente (oltre al limite RPM di _LIMITATORE)
+_MAX_RICHIESTE_CONCORRENTI = 8
 
 
 # ==============================================================================
 # DEMO E ESEMPI PRATICI
 # ==============================================================================
 
+# Query della demo calculator (usate anche dalla modalità batch)
+CALCULATOR_QUERIES = [
+    "Calcola 15 + 27 * 3",
+    "Quanto fa (100 - 25) / 5?",
+    "Calcola l'area di un cerchio con raggio 7 (usa 3.14 per pi greco)"
+]
+
+
+async def _invoke_concorrenti(client, queries: List[str]) -> List[Any]:
+    """Invia in concorrenza query indipendenti; risposte (o eccezioni) nell'ordine delle query
+    
+    Al massimo _MAX_RICHIESTE_CONCORRENTI richieste sono in volo insieme, ciascuna
+    soggetta al rate limit e ai retry su 429. I tool richiesti vengono poi eseguiti
+    dal chiamante query per query, nello stesso ordine di prima: solo l'attesa delle
+    risposte del modello si sovrappone.
+    """
+    semaforo = asyncio.Semaphore(_MAX_RICHIESTE_CONCORRENTI)
+    
+    async def invia(query: str):
+        async with semaforo:
+            return await _a_invoke_con_backoff(client, input=query)
+    
+    return await asyncio.gather(*(invia(query) for query in queries), return_exceptions=True)
+
+
 def demo_single_tool_client():
     """Dimostra l'uso di un client con strumento specializzato"""
     print_section("CLIENT CON STRUMENTO SPECIALIZZATO - Calculator")
     
     try:
-        client = create_calculator_client()
-        print(f"✅ Client matematico creato")
-        
         # Aggiungi i tool al client
-        tools = [calcola]
+        client = bind_tools(create_calculator_client(), TOOLS_CALCOLO)
+        print(f"✅ Client matematico creato")
         
         # Test calcoli semplici
-        queries = [
-            "Calcola 15 + 27 * 3",
-            "Quanto fa (100 - 25) / 5?",
-            "Calcola l'area di un cerchio con raggio 7 (usa 3.14 per pi greco)"
-        ]
+        queries = CALCULATOR_QUERIES
+        
+        # Le query sono indipendenti: le richieste al modello partono insieme
+        responses = asyncio.run(_invoke_concorrenti(client, queries))
         
-        for query in queries:
+        for query, response in zip(queries, responses):
             print_subsection(f"Query: {query}")
+            # Righe del risultato, scritte insieme a fine query (i tool stampano mentre girano)
+            out = []
+            put = out.append
             
             try:
-                response = client.invoke(
-                    input=query, 
-                    tools=tools, 
-                    tool_choice="auto"
-                )
+                if isinstance(response, Exception):
+                    raise response
                 
                 # Esegui tool se presenti
-                tool_results = execute_tool_calls(response, tools)
+                tool_results = execute_tool_calls(response, client.tools)
                 
                 # Se c'è una risposta testuale, mostrala
                 if response.text.strip():
-                    print(f"🤖 Assistente: {response.text}")
+                    put(f"🤖 Assistente: {response.text}")
                 elif tool_results:
-                    print(f"🤖 Assistente: Ho eseguito l'operazione: {tool_results[0]}")
+                    put(f"🤖 Assistente: Ho eseguito l'operazione: {tool_results[0]}")
                 
             except Exception as e:
-                print(f"   ❌ Errore query: {e}")
+                put(f"   ❌ Errore query: {e}")
             
-            print()
+            put("")
+            _scrivi_righe(out)
             
     except Exception as e:
         print(f"❌ Errore: {e}")
@@ -323,11 +978,9 @@ def demo_multi_tool_client():
     print_section("CLIENT MULTI STRUMENTO - Research Assistant")
     
     try:
-        client = create_research_client()
-        print(f"✅ Client di ricerca creato")
-        
         # Aggiungi tutti i tool
-        tools = [cerca_informazioni, gestisci_file]
+        client = bind_tools(create_research_client(), TOOLS_RICERCA)
+        print(f"✅ Client di ricerca creato")
         
         # Test ricerche e gestione file
         queries = [
@@ -336,44 +989,46 @@ def demo_multi_tool_client():
             "Crea un file chiamato research_summary.txt nella directory data/"
         ]
         
-        for query in queries:
+        # Le query sono indipendenti: le richieste al modello partono insieme
+        responses = asyncio.run(_invoke_concorrenti(client, queries))
+        
+        for query, response in zip(queries, responses):
             print_subsection(f"Query: {query}")
+            # Righe del risultato, scritte insieme a fine query (i tool stampano mentre girano)
+            out = []
+            put = out.append
             
             try:
-                response = client.invoke(
-                    input=query, 
-                    tools=tools, 
-                    tool_choice="auto"
-                )
+                if isinstance(response, Exception):
+                    raise response
                 
                 # Esegui tool se presenti
-                tool_results = execute_tool_calls(response, tools)
+                tool_results = execute_tool_calls(response, client.tools)
                 
                 # Mostra risposta
                 if response.text.strip():
-                    print(f"🤖 Assistente: {response.text}")
+                    put(f"🤖 Assistente: {response.text}")
                 elif tool_results:
-                    print(f"🤖 Assistente: Ho completato l'operazione: {'; '.join(tool_results[:2])}")
+                    put(f"🤖 Assistente: Ho completato l'operazione: {'; '.join(tool_results[:2])}")
                 
             except Exception as e:
-                print(f"   ❌ Errore query: {e}")
+                put(f"   ❌ Errore query: {e}")
             
-            print()
+            put("")
+            _scrivi_righe(out)
             
     except Exception as e:
         print(f"❌ Errore: {e}")
 
 
-def demo_complex_workflow():
-    """Dimostra un workflow complesso con client multi-tool"""
+def demo_complex_workflow(riprendi: bool = False):
+    """Dimostra un workflow complesso con client multi-tool (riprendi: riusa il checkpoint dei tool)"""
     print_section("WORKFLOW COMPLESSO - Multi-Tool Client")
     
     try:
-        client = create_multi_tool_client()
-        print(f"✅ Client multi-tool creato con tutti gli strumenti disponibili")
-        
         # Tutti i tool disponibili
-        tools = [calcola, cerca_informazioni, gestisci_file]
+        client = bind_tools(create_multi_tool_client(), TOOLS_TUTTI)
+        print(f"✅ Client multi-tool creato con tutti gli strumenti disponibili")
         
         # Workflow complesso: ricerca + calcolo + gestione file
         complex_query = """
@@ -389,19 +1044,38 @@ def demo_complex_workflow():
         print(f"Query: {complex_query.strip()}")
         
         try:
-            response = client.invoke(
-                input=complex_query, 
-                tools=tools, 
-                tool_choice="auto"
-            )
+            checkpoint = WorkflowCheckpoint(complex_query, riprendi=riprendi)
+            response = checkpoint.risposta_salvata()
+            if response is not None:
+                # Ripresa: la risposta del modello (e quindi le tool call) viene dal checkpoint
+                print(f"\n♻️ Ripresa da checkpoint: risposta del modello e "
+                      f"{len(checkpoint.risultati)} risultati già calcolati")
+                testo = [response.text]
+                if response.text:
+                    print(f"\n🤖 Assistente: {response.text}")
+            else:
+                # Streaming: il testo viene stampato man mano che arriva, senza
+                # attendere la fine della risposta
+                testo = []
+                for chunk in client.stream_invoke(input=complex_query, tool_choice="auto"):
+                    if chunk.text:
+                        if not testo:
+                            print("\n🤖 Assistente: ", end="", flush=True)
+                        print(chunk.text, end="", flush=True)
+                        testo.append(chunk.text)
+                    # Le chiamate ai tool arrivano nei blocchi di contenuto dei chunk
+                    if getattr(chunk, "content", None):
+                        response = chunk
+                if testo:
+                    print()
+                response = checkpoint.salva_risposta("".join(testo), response)
             
-            # Esegui tool se presenti
-            tool_results = execute_tool_calls(response, tools)
+            # Esegui i tool, salvando i risultati nel checkpoint
+            tool_results = execute_tool_calls(response, client.tools, checkpoint)
+            if not checkpoint.completa():
+                print(f"\n⚠️ {checkpoint.fallite} tool falliti: checkpoint conservato, riprendi con --resume")
             
-            # Mostra risposta finale
-            if response.text.strip():
-                print(f"\n🤖 Assistente: {response.text}")
-            elif tool_results:
+            if not "".join(testo).strip() and tool_results:
                 print(f"\n🤖 Assistente: Workflow completato con {len(tool_results)} operazioni")
                     
         except Exception as e:
@@ -411,14 +1085,111 @@ def demo_complex_workflow():
         print(f"❌ Errore: {e}")
 
 
+# Oltre MEMORY_MAX_TURNS turni i più vecchi vengono riassunti, tenendo gli ultimi MEMORY_KEEP_RECENT
+MEMORY_MAX_TURNS = 8
+MEMORY_KEEP_RECENT = 4
+
+
+def compatta_memoria(memory, max_turns: int = MEMORY_MAX_TURNS, keep_recent: int = MEMORY_KEEP_RECENT) -> bool:
+    """Sostituisce i turni più vecchi con un loro riassunto
+    
+    Così l'input di ogni chiamata resta limitato invece di crescere a ogni turno.
+    Restituisce True se la memoria è stata compattata.
+    """
+    from datapizzai.memory import Memory
+    from datapizzai.type import TextBlock, ROLE
+    
+    if len(memory.memory) <= max_turns:
+        return False
+    
+    vecchi = Memory()
+    vecchi.memory.extend(memory.memory[:-keep_recent])
+    riassunto = get_client("summary").invoke(
+        "Riassumi brevemente questa conversazione mantenendo informazioni chiave",
+        memory=vecchi
+    )
+    
+    compattata = Memory()
+    compattata.add_turn([TextBlock(content=f"Riassunto conversazione precedente: {riassunto.text}")], ROLE.ASSISTANT)
+    memory.memory[:] = compattata.memory + memory.memory[-keep_recent:]
+    return True
+
+
+_PAROLA_RE = re.compile(r"\w+")
+
+# Molti modelli racchiudono il JSON in un blocco ```json ... ``` anche se non richiesto
+_RECINTO_RE = re.compile(r"^\s*```(?:json)?\s*(.*?)\s*```\s*$", re.DOTALL | re.IGNORECASE)
+
+
+def _parole(testo: str) -> frozenset:
+    """Insieme delle parole (minuscole, almeno 3 caratteri) di un testo"""
+    return frozenset(p for p in _PAROLA_RE.findall(testo.lower()) if len(p) >= 3)
+
+
+class FactStore:
+    """Memoria a lungo termine a fatti: estrae fatti atomici dopo ogni turno e recupera solo i pertinenti
+    
+    L'estrazione gira in background su un modello piccolo mentre la demo prosegue e il
+    recupero non la attende: usa i fatti già memorizzati, quelli del turno appena
+    concluso arrivano al turno successivo. Il recupero ordina i fatti per parole in
+    comune con la query (niente embedding o database vettoriali: pochi fatti per
+    conversazione non li giustificano).
+    """
+    
+    def __init__(self):
+        self.fatti: List[str] = []
+        self._parole: List[frozenset] = []
+        self._lock = threading.Lock()
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+    
+    def estrai_async(self, utente: str, assistente: str):
+        """Avvia in background l'estrazione dei fatti dal turno"""
+        self._executor.submit(self._estrai, utente, assistente)
+    
+    def _estrai(self, utente: str, assistente: str):
+        risposta = get_client("facts").invoke(f"Utente: {utente}\nAssistente: {assistente}")
+        testo = risposta.text or ""
+        recinto = _RECINTO_RE.match(testo)
+        if recinto:
+            testo = recinto.group(1)
+        try:
+            nuovi = json.loads(testo)
+        except ValueError:
+            return
+        if not isinstance(nuovi, list):
+            return
+        with self._lock:
+            for fatto in nuovi:
+                if isinstance(fatto, str) and fatto and fatto not in self.fatti:
+                    self.fatti.append(fatto)
+                    self._parole.append(_parole(fatto))
+    
+    def recupera(self, query: str, k: int = 5) -> List[str]:
+        """Restituisce fino a k fatti pertinenti alla query (senza attendere le estrazioni in corso)"""
+        parole_query = _parole(query)
+        with self._lock:
+            punteggi = [(len(parole_query & parole), i) for i, parole in enumerate(self._parole)]
+            migliori = sorted((p for p in punteggi if p[0] > 0), reverse=True)[:k]
+            return [self.fatti[i] for _, i in sorted(migliori, key=lambda p: p[1])]
+    
+    def close(self, attendi: bool = True):
+        """Chiude l'executor: attende le estrazioni in corso, o le annulla con attendi=False"""
+        self._executor.shutdown(wait=attendi, cancel_futures=not attendi)
+
+
 def demo_client_memory():
     """Dimostra l'uso della memoria con client multi-tool"""
     print_section("CLIENT CON MEMORIA - Conversazione Multi-Tool")
     
+    from datapizzai.memory import Memory
+    from datapizzai.type import TextBlock, ROLE
+    
+    fatti = None
     try:
-        client = create_multi_tool_client()
+        # Il client arriva dal pool: a ogni esecuzione si riparte solo da una memoria vuota
+        client = bind_tools(create_multi_tool_client(), TOOLS_TUTTI)
         memory = Memory()
-        tools = [calcola, cerca_informazioni, gestisci_file]
+        fatti = FactStore()
         
         print(f"✅ Client multi-tool con memoria attivata")
         
@@ -433,47 +1204,153 @@ def demo_client_memory():
         ]
         
         for i, user_input in enumerate(conversation, 1):
-            print_subsection(f"Turno {i}")
-            print(f"👤 Utente: {user_input}")
+            # Intestazione e domanda escono subito, prima della chiamata al modello
+            out = [f"\n--- Turno {i} ---", f"👤 Utente: {user_input}"]
+            put = out.append
             
-            # Aggiungi alla memoria
-            memory.add_turn([TextBlock(content=user_input)], ROLE.USER)
+            # Aggiungi alla memoria, con i fatti noti pertinenti (il system prompt resta statico)
+            blocchi = [TextBlock(content=user_input)]
+            pertinenti = fatti.recupera(user_input)
+            if pertinenti:
+                blocchi.insert(0, TextBlock(content="Fatti noti: " + "; ".join(pertinenti)))
+                put(f"   🧠 Fatti recuperati: {len(pertinenti)}")
+            memory.add_turn(blocchi, ROLE.USER)
+            _scrivi_righe(out)
+            out.clear()
             
             try:
                 # Invoca client con memoria
                 response = client.invoke(
                     input="", 
                     memory=memory, 
-                    tools=tools, 
                     tool_choice="auto"
                 )
                 memory.add_turn(response.content, ROLE.ASSISTANT)
                 
+                # Estrazione fatti in background, in parallelo ai tool
+                fatti.estrai_async(user_input, response.text)
+                
                 # Esegui tool se presenti
-                tool_results = execute_tool_calls(response, tools)
+                tool_results = execute_tool_calls(response, client.tools)
                 
                 # Mostra risposta finale
                 if response.text.strip():
-                    print(f"🤖 Assistente: {response.text}")
+                    put(f"🤖 Assistente: {response.text}")
                 elif tool_results:
-                    print(f"🤖 Assistente: {tool_results[0]}")
+                    put(f"🤖 Assistente: {tool_results[0]}")
                         
             except Exception as e:
-                print(f"   ❌ Errore turno: {e}")
+                put(f"   ❌ Errore turno: {e}")
                 # Aggiungi messaggio di errore alla memoria
                 memory.add_turn([TextBlock(content=f"Errore: {e}")], ROLE.ASSISTANT)
             
-            print()
+            try:
+                if compatta_memoria(memory):
+                    put("📝 Turni precedenti riassunti per limitare i token")
+            except Exception as e:
+                put(f"   ⚠️ Riassunto non riuscito, memoria invariata: {e}")
+            
+            put("")
+            _scrivi_righe(out)
         
-        # Statistiche conversazione
+        # Statistiche conversazione: prima si attende l'estrazione dell'ultimo turno
+        fatti.close()
         print_subsection("Statistiche conversazione")
         print(f"   📚 Turni totali: {len(memory.memory)}")
         print(f"   💬 Blocchi totali: {len(list(memory.iter_blocks()))}")
+        print(f"   🧠 Fatti memorizzati: {len(fatti.fatti)}")
         
     except Exception as e:
+        if fatti is not None:
+            fatti.close(attendi=False)
         print(f"❌ Errore: {e}")
 
 
+# ==============================================================================
+# MODALITÀ BATCH (OpenAI Batch API)
+# ==============================================================================
+
+# Stati finali di un batch OpenAI
+_BATCH_STATI_FINALI = frozenset({"completed", "failed", "expired", "cancelled"})
+
+
+def build_batch_requests(queries: List[str], system_prompt: str, model: str = "gpt-4o") -> List[Dict[str, Any]]:
+    """Crea una richiesta /v1/chat/completions per query, nel formato JSONL della Batch API"""
+    return [
+        {
+            "custom_id": f"q-{i}",
+            "method": "POST",
+            "url": "/v1/chat/completions",
+            "body": {
+                "model": model,
+                "messages": [
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": query}
+                ]
+            }
+        }
+        for i, query in enumerate(queries)
+    ]
+
+
+def run_batch(queries: List[str], system_prompt: str, path: str = "batch_requests.jsonl",
+              poll_seconds: int = 60) -> Dict[str, str]:
+    """Invia le query tramite Batch API (costo dimezzato, risultati entro 24h) e attende l'esito
+    
+    Returns:
+        Dizionario custom_id -> testo della risposta
+    """
+    import openai
+    
+    _load_env()
+    with open(path, "wb") as f:
+        f.writelines(_riga_jsonl(request) for request in build_batch_requests(queries, system_prompt))
+    
+    api = openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+    with open(path, "rb") as f:
+        input_file = api.files.create(file=f, purpose="batch")
+    batch = api.batches.create(
+        input_file_id=input_file.id,
+        endpoint="/v1/chat/completions",
+        completion_window="24h"
+    )
+    print(f"📤 Batch {batch.id} inviato ({len(queries)} richieste)")
+    
+    while batch.status not in _BATCH_STATI_FINALI:
+        time.sleep(poll_seconds)
+        batch = api.batches.retrieve(batch.id)
+        print(f"   ⏳ Stato batch: {batch.status}")
+    
+    if batch.status != "completed" or not batch.output_file_id:
+        raise RuntimeError(f"Batch {batch.id} terminato con stato {batch.status}")
+    
+    risposte = {}
+    for line in api.files.content(batch.output_file_id).text.splitlines():
+        record = json.loads(line)
+        body = (record.get("response") or {}).get("body") or {}
+        choices = body.get("choices") or [{}]
+        risposte[record["custom_id"]] = choices[0].get("message", {}).get("content") or ""
+    return risposte
+
+
+def demo_batch_calcoli():
+    """Rigenera le risposte della demo calculator tramite Batch API (senza tool)"""
+    print_section("MODALITÀ BATCH - Calculator")
+    
+    try:
+        risposte = run_batch(CALCULATOR_QUERIES, SYSTEM_PROMPTS["calculator"])
+    except Exception as e:
+        print(f"❌ Errore batch: {e}")
+        return
+    
+    for i, query in enumerate(CALCULATOR_QUERIES):
+        _scrivi_righe([
+            f"\n--- Query: {query} ---",
+            f"🤖 Assistente: {risposte.get(f'q-{i}', 'Nessuna risposta')}",
+            "",
+        ])
+
+
 # ==============================================================================
 # UTILITÀ E TESTING
 # ==============================================================================
@@ -488,9 +1365,15 @@ def test_tools_individually():
     
     for test_case in test_cases:
         result = calcola(test_case)
-        print(f"Input: {test_case}")
-        print(f"Output: {result}")
-        print()
+        _scrivi_righe([f"Input: {test_case}", f"Output: {result}", ""])
+    
+    # Test calcolo vettoriale
+    print_subsection("Test calcolo vettoriale: calcola_batch")
+    prezzi = [10.0, 25.5, 99.9]
+    print(f"Input: prezzo * 1.22 con prezzo={prezzi}")
+    risultati = calcola_batch('prezzo * 1.22', {'prezzo': prezzi})
+    print(f"Output: {[round(float(r), 2) for r in risultati]}")
+    print()
     
     # Test WebSearch
     print_subsection("Test Tool: cerca_informazioni")
@@ -498,9 +1381,7 @@ def test_tools_individually():
     
     for query in test_queries:
         result = cerca_informazioni(query)
-        print(f"Query: {query}")
-        print(f"Output: {result}")
-        print()
+        _scrivi_righe([f"Query: {query}", f"Output: {result}", ""])
     
     # Test FileManager
     print_subsection("Test Tool: gestisci_file")
@@ -513,29 +1394,18 @@ def test_tools_individually():
     
     for comando, percorso in test_commands:
         result = gestisci_file(comando, percorso)
-        print(f"Comando: {comando} {percorso}")
-        print(f"Output: {result}")
-        print()
+        _scrivi_righe([f"Comando: {comando} {percorso}", f"Output: {result}", ""])
 
 
 def show_available_tools():
     """Mostra tutti gli strumenti disponibili con descrizioni"""
     print_section("STRUMENTI DISPONIBILI")
     
-    print_subsection("🔧 calcola")
-    print(f"Descrizione: {calcola.description}")
-    print(f"Nome: {calcola.name}")
-    print()
-    
-    print_subsection("🔧 cerca_informazioni")
-    print(f"Descrizione: {cerca_informazioni.description}")
-    print(f"Nome: {cerca_informazioni.name}")
-    print()
-    
-    print_subsection("🔧 gestisci_file")
-    print(f"Descrizione: {gestisci_file.description}")
-    print(f"Nome: {gestisci_file.name}")
-    print()
+    for tool in TOOLS_TUTTI:
+        print_subsection(f"🔧 {tool.name}")
+        print(f"Descrizione: {tool.description}")
+        print(f"Nome: {tool.name}")
+        print()
 
 
 # ==============================================================================
@@ -588,6 +1458,7 @@ def main():
     
     # Verifica supporto OpenAI
     print("🔍 Verifica supporto OpenAI...")
+    _load_env()
     
     if not os.getenv("OPENAI_API_KEY"):
         print("""
@@ -603,6 +1474,20 @@ Questa chiave è necessaria per tutte le demo dei client con strumenti.
     
     print("✅ OPENAI_API_KEY configurata")
     
+    # Rigenerazione offline delle risposte: nessun menu interattivo
+    if "--batch" in sys.argv[1:]:
+        demo_batch_calcoli()
+        return
+    
+    # Ripresa del workflow complesso interrotto, riusando i risultati già salvati
+    if "--resume" in sys.argv[1:]:
+        demo_complex_workflow(riprendi=True)
+        return
+    
+    # I client delle demo vengono preparati in background durante la scelta dal menu;
+    # eventuali errori emergono poi nella demo che usa il client
+    warmup_clients()
+    
     # Menu principale
     while True:
         try:
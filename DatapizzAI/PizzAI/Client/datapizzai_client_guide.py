@@ -12,6 +12,7 @@ Data: 2025
 """
 
 import os
+from collections import Counter
 from typing import List, Optional
 from pydantic import BaseModel
 from dotenv import load_dotenv
@@ -1099,9 +1100,9 @@ def esempio_assistente_completo():
                 print(f"   🔍 Stop reason: {response.stop_reason}")
                 
                 # Controlla se sono stati usati tools
-                tool_calls = [block for block in response.content if hasattr(block, 'name')]
-                if tool_calls:
-                    print(f"   🔧 Tools usati: {[t.name for t in tool_calls]}")
+                tool_names = [name for name in (getattr(block, 'name', None) for block in response.content) if name]
+                if tool_names:
+                    print(f"   🔧 Tools usati: {tool_names}")
             
             # Aggiungi risposta alla memoria
             memory.add_turn(response.content, ROLE.ASSISTANT)
@@ -1126,15 +1127,11 @@ def esempio_assistente_completo():
     
     # 3. Statistiche finali
     print(f"\n3. Statistiche conversazione:")
-    print(f"   📚 Turni di conversazione: {len(memory.memory)}")
-    print(f"   💬 Blocchi totali: {len(list(memory.iter_blocks()))}")
-    
-    # Analizza i tipi di blocchi
-    block_types = {}
-    for block in memory.iter_blocks():
-        block_type = type(block).__name__
-        block_types[block_type] = block_types.get(block_type, 0) + 1
+    # Analizza i tipi di blocchi (un solo passaggio sulla memoria)
+    block_types = dict(Counter(type(block).__name__ for block in memory.iter_blocks()))
     
+    print(f"   📚 Turni di conversazione: {len(memory.memory)}")
+    print(f"   💬 Blocchi totali: {sum(block_types.values())}")
     print(f"   📊 Tipi di blocchi: {block_types}")
     
     print("✅ Esempio assistente completo terminato")
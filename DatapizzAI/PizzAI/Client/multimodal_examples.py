@@ -18,12 +18,28 @@ Autore: Marco Calcaterra
 Data: 2025
 """
 
+import io
 import os
+import re
+import sys
+import json
+import mmap
 import time
+import asyncio
+import concurrent.futures
 import base64
+import hashlib
+import weakref
+import threading
+import inspect
+import functools
 import requests
+from types import MappingProxyType
+from collections import Counter
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from pathlib import Path
-from typing import List, Union, Optional
+from typing import List, Dict, Tuple, Union, Optional, Callable
 from dotenv import load_dotenv
 
 # Carica le variabili d'ambiente dal file .env nella directory parent
@@ -36,6 +52,58 @@ from datapizzai.memory import Memory
 from datapizzai.type import TextBlock, MediaBlock, Media, ROLE
 from datapizzai.cache import MemoryCache
 
+# httpx è opzionale: se presente i client condividono un pool di connessioni keep-alive
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+# diskcache è opzionale: se presente le analisi di immagini già viste vengono riusate
+try:
+    import diskcache
+except ImportError:
+    diskcache = None
+
+# pybase64 è opzionale: codifica/decodifica base64 con kernel SIMD (AVX2/NEON), più veloce della stdlib
+try:
+    import pybase64
+except ImportError:
+    pybase64 = None
+
+# Pillow è opzionale: serve solo per ridimensionare le immagini inviate con detail="low"
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+# tiktoken è opzionale: senza, i token sono stimati dalla lunghezza del testo
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+# NumPy è opzionale: serve solo per la ricerca per similarità dei prompt augmentati
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# HTTP/2 richiede il pacchetto h2 (pip install httpx[http2])
+try:
+    import h2  # noqa: F401
+    _HTTP2 = True
+except ImportError:
+    _HTTP2 = False
+
+
+# System prompt statico: resta identico byte per byte tra chiamate e turni, così il prefisso
+# della richiesta può essere riusato dalla prompt cache del provider. Il contesto variabile
+# (immagini, turni precedenti) viaggia sempre nei messaggi successivi, mai qui.
+MULTIMODAL_SYSTEM_PROMPT = (
+    "Sei un assistente AI multimodale specializzato nell'analisi di immagini. "
+    "Rispondi in italiano in modo dettagliato e professionale."
+)
+
 
 def print_section(title: str):
     """Stampa una sezione formattata"""
@@ -49,10 +117,166 @@ def print_subsection(title: str):
     print(f"\n--- {title} ---")
 
 
+@functools.lru_cache(maxsize=1)
+def _shared_http_client():
+    """Client HTTP condiviso (keep-alive, HTTP/2 se disponibile) o None senza httpx"""
+    if httpx is None:
+        return None
+    return httpx.Client(
+        http2=_HTTP2,
+        limits=httpx.Limits(max_keepalive_connections=32, max_connections=64),
+        timeout=httpx.Timeout(60, connect=5)
+    )
+
+
+@functools.lru_cache(maxsize=1)
+def _factory_http_kwargs() -> dict:
+    """Passa il client HTTP condiviso a ClientFactory.create solo se la factory lo accetta"""
+    http_client = _shared_http_client()
+    if http_client is None:
+        return {}
+    try:
+        params = inspect.signature(ClientFactory.create).parameters
+    except (TypeError, ValueError):
+        return {}
+    return {"http_client": http_client} if "http_client" in params else {}
+
+
+@functools.lru_cache(maxsize=1)
+def _http_session() -> requests.Session:
+    """Sessione requests condivisa per i download (connessioni keep-alive riusate)
+    
+    Errori di connessione, 429 e 5xx transitori vengono ritentati sulla stessa
+    connessione in pool (backoff breve, rispettando Retry-After).
+    """
+    session = requests.Session()
+    retry = Retry(total=3, backoff_factor=0.2, status_forcelist=(429, 500, 502, 503, 504),
+                  allowed_methods=frozenset({"GET", "HEAD"}), raise_on_status=False)
+    adapter = HTTPAdapter(pool_connections=8, pool_maxsize=32, max_retries=retry)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+class ImageAssetCache:
+    """Cache su disco delle immagini scaricate da URL, indirizzata per sha256(url)
+    
+    Al primo uso nel processo la copia su disco viene rivalidata con una GET
+    condizionale (ETag / Last-Modified): con 304 non si riscarica nulla. Le
+    richieste successive per lo stesso URL leggono dalla memoria.
+    """
+    
+    def __init__(self, cache_dir: str = ".img_cache"):
+        self.cache_dir = Path(cache_dir)
+        self._validati = {}
+    
+    def get(self, url: str) -> bytes:
+        """Restituisce i byte dell'immagine all'URL, scaricandola solo se cambiata"""
+        if url in self._validati:
+            return self._validati[url]
+        
+        chiave = hashlib.sha256(url.encode("utf-8")).hexdigest()
+        dati_path = self.cache_dir / chiave
+        meta_path = self.cache_dir / f"{chiave}.json"
+        
+        headers = {}
+        if dati_path.exists() and meta_path.exists():
+            meta = json.loads(meta_path.read_text(encoding="utf-8"))
+            if meta.get("etag"):
+                headers["If-None-Match"] = meta["etag"]
+            if meta.get("last_modified"):
+                headers["If-Modified-Since"] = meta["last_modified"]
+        
+        response = _http_session().get(url, headers=headers, timeout=30)
+        if response.status_code == 304:
+            dati = dati_path.read_bytes()
+        else:
+            response.raise_for_status()
+            dati = response.content
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            dati_path.write_bytes(dati)
+            meta_path.write_text(json.dumps({
+                "url": url,
+                "etag": response.headers.get("ETag"),
+                "last_modified": response.headers.get("Last-Modified")
+            }), encoding="utf-8")
+        
+        self._validati[url] = dati
+        return dati
+
+
+_IMAGE_CACHE = ImageAssetCache()
+
+# Provider che rifiutano le immagini da URL: ricevono i byte in base64. Vuoto finché un
+# provider non lo richiede: nelle richieste singole gli altri ricevono l'URL così com'è
+# (niente overhead 4/3 del base64); le conversazioni, che rinviano l'immagine a ogni
+# turno, la scaricano una volta tramite _IMAGE_CACHE
+_URL_INLINE_PROVIDERS = frozenset()
+
+
+# Provider che supportano analisi immagini (configurazione letta una volta, in sola lettura)
+_PROVIDERS = MappingProxyType({
+    "openai": MappingProxyType({
+        "api_key_env": "OPENAI_API_KEY",
+        "model": os.getenv("OPENAI_VISION_MODEL", "gpt-4o"),
+        "features": ("images", "text", "generation"),
+        "cache_supported": True
+    }),
+    "google": MappingProxyType({
+        "api_key_env": "GOOGLE_API_KEY", 
+        "model": os.getenv("GOOGLE_VISION_MODEL", "gemini-2.5-flash"),
+        "features": ("images", "text"),
+        "cache_supported": False
+    })
+})
+
+
+# Cache su disco delle analisi (LRU, 512MB): chiave = contenuto immagine + prompt + modello.
+# Contiene anche le miniature usate con detail="low" (chiavi "thumb:v2:<sha1>:<lato>")
+ANALYSIS_CACHE_DIR = ".mm_cache"
+
+
+@functools.lru_cache(maxsize=1)
+def _analysis_cache():
+    """Cache su disco delle analisi, o None senza diskcache"""
+    if diskcache is None:
+        return None
+    return diskcache.Cache(
+        ANALYSIS_CACHE_DIR,
+        size_limit=512 * 1024 * 1024,
+        eviction_policy="least-recently-used"
+    )
+
+
+def _analysis_cache_key(model: str, prompt: str, image_block: MediaBlock) -> str:
+    """SHA256 dei byte dell'immagine (decodificati, non la stringa base64) + prompt + modello
+    
+    Per le immagini da URL si usa l'URL: scaricarle solo per calcolare la chiave
+    costerebbe quanto la richiesta che la cache vuole evitare.
+    """
+    media = image_block.media
+    if media.source_type == "base64":
+        image_bytes = _b64decode(media.source)
+    else:
+        image_bytes = str(media.source).encode("utf-8")
+    digest = hashlib.sha256(image_bytes)
+    digest.update(b"\0" + prompt.encode("utf-8") + b"\0" + model.encode("utf-8"))
+    return digest.hexdigest()
+
+
+# Client creati con successo, per (provider, use_cache): i fallimenti non vengono
+# memorizzati, così una chiave API aggiunta dopo viene vista al tentativo successivo
+_CLIENT_MULTIMODALI: Dict[Tuple[str, bool], object] = {}
+
+
 def create_multimodal_client(provider_name: str = "openai", use_cache: bool = False) -> Optional[object]:
     """
     Crea un client che supporta contenuti multimodali
     
+    Le chiamate successive con gli stessi argomenti restituiscono lo stesso client,
+    con il suo pool di connessioni e la sua cache; se la creazione fallisce la
+    chiamata successiva riprova.
+    
     Args:
         provider_name: "openai" o "google"
         use_cache: Se abilitare la cache (solo OpenAI)
@@ -61,27 +285,15 @@ def create_multimodal_client(provider_name: str = "openai", use_cache: bool = Fa
         Client configurato o None se errore
     """
     
-    # Provider che supportano analisi immagini
-    multimodal_providers = {
-        "openai": {
-            "api_key_env": "OPENAI_API_KEY",
-            "model": os.getenv("OPENAI_VISION_MODEL", "gpt-4o"),
-            "features": ["images", "text", "generation"],
-            "cache_supported": True
-        },
-        "google": {
-            "api_key_env": "GOOGLE_API_KEY", 
-            "model": os.getenv("GOOGLE_VISION_MODEL", "gemini-2.5-flash"),
-            "features": ["images", "text"],
-            "cache_supported": False
-        }
-    }
+    client = _CLIENT_MULTIMODALI.get((provider_name, use_cache))
+    if client is not None:
+        return client
     
-    if provider_name not in multimodal_providers:
+    if provider_name not in _PROVIDERS:
         print(f"❌ Provider {provider_name} non supporta contenuti multimodali")
         return None
     
-    config = multimodal_providers[provider_name]
+    config = _PROVIDERS[provider_name]
     api_key = os.getenv(config["api_key_env"])
     
     if not api_key:
@@ -90,7 +302,7 @@ def create_multimodal_client(provider_name: str = "openai", use_cache: bool = Fa
     
     # Cache solo per provider che la supportano
     cache = None
-    extra_kwargs = {}
+    extra_kwargs = dict(_factory_http_kwargs())
     
     if use_cache and config.get("cache_supported", False):
         cache = MemoryCache()
@@ -102,7 +314,7 @@ def create_multimodal_client(provider_name: str = "openai", use_cache: bool = Fa
             provider=provider_name,
             api_key=api_key,
             model=model_name,
-            system_prompt="Sei un assistente AI multimodale specializzato nell'analisi di immagini. Rispondi in italiano in modo dettagliato e professionale.",
+            system_prompt=MULTIMODAL_SYSTEM_PROMPT,
             temperature=0.7,
             **extra_kwargs
         )
@@ -115,6 +327,8 @@ def create_multimodal_client(provider_name: str = "openai", use_cache: bool = Fa
         elif use_cache:
             print(f"   ⚠️ Cache non supportata per {provider_name}")
         
+        if client is not None:
+            _CLIENT_MULTIMODALI[(provider_name, use_cache)] = client
         return client
         
     except Exception as e:
@@ -122,20 +336,134 @@ def create_multimodal_client(provider_name: str = "openai", use_cache: bool = Fa
         return None
 
 
-def load_image_as_base64(image_path: str) -> Optional[str]:
+def _b64encode(data) -> str:
+    """Base64 come str (pybase64 se installato, altrimenti stdlib)
+    
+    Accetta qualsiasi buffer (bytes, mmap): con la stdlib i dati grandi sono codificati
+    a blocchi, così oltre al risultato non esiste una seconda copia dell'output in bytes.
+    """
+    if pybase64 is not None:
+        return pybase64.b64encode_as_string(data)
+    if len(data) <= _STREAM_B64_THRESHOLD:
+        return base64.b64encode(data).decode('ascii')
+    out = bytearray()
+    with memoryview(data) as view:
+        for start in range(0, len(view), _B64_CHUNK_SIZE):
+            out += base64.b64encode(view[start:start + _B64_CHUNK_SIZE])
+    return out.decode('ascii')
+
+
+def _b64decode(data: str) -> bytes:
+    if pybase64 is not None:
+        return pybase64.b64decode(data, validate=True)
+    return base64.b64decode(data)
+
+
+# Blocchi multipli di 3 byte: ogni blocco produce gruppi base64 completi, senza padding intermedio
+_B64_CHUNK_SIZE = 3 * 65536
+
+# Oltre questa dimensione i file vengono codificati direttamente dal file mappato in memoria,
+# senza copiarne i byte in un bytes Python né tenerli nella cache dei file letti
+_STREAM_B64_THRESHOLD = 8 * 1024 * 1024
+
+# Dimensione massima di un file inviato così com'è (le immagini ridimensionate sono escluse)
+MAX_MEDIA_BYTES = int(os.getenv("DATAPIZZAI_MAX_MEDIA_BYTES", 25 * 1024 * 1024))
+
+
+def _check_media_size(image_path: str, size: int):
+    """Rifiuta subito i file oltre MAX_MEDIA_BYTES, prima di leggerli e codificarli"""
+    if size > MAX_MEDIA_BYTES:
+        raise ValueError(
+            f"{Path(image_path).name} pesa {size:,} byte, oltre il limite di {MAX_MEDIA_BYTES:,} "
+            f"(DATAPIZZAI_MAX_MEDIA_BYTES)"
+        )
+
+
+def _madvise_sequential(data: mmap.mmap):
+    """Lettura sequenziale: il kernel anticipa il read-ahead e libera prima le pagine lette"""
+    if hasattr(data, "madvise") and hasattr(mmap, "MADV_SEQUENTIAL"):  # non su Windows
+        data.madvise(mmap.MADV_SEQUENTIAL)
+
+
+@functools.lru_cache(maxsize=32)
+def _read_file_bytes(image_path: str, mtime_ns: int, size: int) -> bytes:
+    """Legge il file; mtime e dimensione nella chiave invalidano la cache se cambia"""
+    if size == 0:
+        return b""
+    with open(image_path, "rb") as image_file:
+        # mmap evita la crescita a blocchi del buffer di lettura: una sola copia nel bytes finale
+        with mmap.mmap(image_file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            _madvise_sequential(data)
+            return data[:]
+
+
+def _file_digest(path: str) -> str:
+    """SHA-1 del contenuto del file, letto a blocchi da 1MiB"""
+    with open(path, "rb") as f:
+        if hasattr(hashlib, "file_digest"):  # Python 3.11+
+            return hashlib.file_digest(f, "sha1").hexdigest()
+        digest = hashlib.sha1()
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+        return digest.hexdigest()
+
+
+@functools.lru_cache(maxsize=32)
+def _downsample_file(image_path: str, mtime_ns: int, size: int, max_dim: int) -> bytes:
+    """File ridotto a lato massimo max_dim: JPEG, o PNG se l'immagine ha trasparenza
+    
+    Le immagini che entrano già in max_dim restituiscono i byte originali, senza
+    ricompressione. Le riduzioni sono salvate anche nella cache su disco, per contenuto
+    del file e max_dim: tra un'esecuzione e l'altra la stessa immagine non viene
+    decodificata e ricompressa. Il formato del risultato si ricava con sniff_image_extension.
     """
-    Carica un'immagine locale e la converte in base64
+    cache = _analysis_cache()
+    key = f"thumb:v2:{_file_digest(image_path)}:{max_dim}" if cache is not None else None
+    if cache is not None:
+        cached = cache.get(key)
+        if cached is not None:
+            return cached
+    with Image.open(image_path) as img:
+        if max(img.size) <= max_dim:
+            _check_media_size(image_path, size)
+            return _read_file_bytes(image_path, mtime_ns, size)
+        alfa = img.mode in ("RGBA", "LA", "PA") or "transparency" in img.info
+        # JPEG non ha canale alfa: le immagini trasparenti restano PNG
+        img = img.convert("RGBA" if alfa else "RGB")
+    img.thumbnail((max_dim, max_dim), Image.LANCZOS)
+    buffer = io.BytesIO()
+    if alfa:
+        img.save(buffer, format="PNG", optimize=True)
+    else:
+        img.save(buffer, format="JPEG", quality=85)
+    if cache is not None:
+        cache.set(key, buffer.getvalue())
+    return buffer.getvalue()
+
+
+def load_image_bytes(image_path: str, max_dim: Optional[int] = None) -> bytes:
+    """
+    Carica i byte grezzi di un'immagine locale
     
-    Args:
-        image_path: Percorso del file immagine
-        
-    Returns:
-        String base64 dell'immagine o None se errore
+    I byte sono memorizzati per (percorso, mtime, dimensione): in cache restano i dati
+    originali, 3/4 della loro codifica base64, che viene prodotta solo quando serve.
+    Con max_dim (e Pillow installato) le immagini più grandi sono ridimensionate
+    (JPEG, o PNG se trasparenti).
     """
+    st = os.stat(image_path)
+    if max_dim and Image is not None:
+        return _downsample_file(image_path, st.st_mtime_ns, st.st_size, max_dim)
+    _check_media_size(image_path, st.st_size)
+    if st.st_size > _STREAM_B64_THRESHOLD:
+        # File grandi letti senza cache: non restano in memoria dopo l'uso
+        return _read_file_bytes.__wrapped__(image_path, st.st_mtime_ns, st.st_size)
+    return _read_file_bytes(image_path, st.st_mtime_ns, st.st_size)
+
+
+def _try_load_image_bytes(image_path: str, max_dim: Optional[int] = None) -> Optional[bytes]:
+    """load_image_bytes che segnala l'errore e restituisce None invece di sollevarlo"""
     try:
-        with open(image_path, "rb") as image_file:
-            image_data = base64.b64encode(image_file.read()).decode('utf-8')
-            return image_data
+        return load_image_bytes(image_path, max_dim)
     except FileNotFoundError:
         print(f"⚠️ File {image_path} non trovato")
         return None
@@ -144,13 +472,61 @@ def load_image_as_base64(image_path: str) -> Optional[str]:
         return None
 
 
+# MediaBlock già creati, per SHA-256 del contenuto: la stessa immagine scelta più volte
+# (o presente in più file) condivide un solo payload base64 finché qualcuno la usa
+_MEDIA_INTERN = weakref.WeakValueDictionary()
+_MEDIA_INTERN_LOCK = threading.Lock()
+
+
+def intern_image_block(image_bytes: bytes, extension: Optional[str] = None, detail: str = "high") -> MediaBlock:
+    """MediaBlock base64 per i byte dati (anche un mmap), riusando quello esistente se l'immagine è già in uso"""
+    key = (hashlib.sha256(image_bytes).digest(), extension, detail)
+    with _MEDIA_INTERN_LOCK:
+        block = _MEDIA_INTERN.get(key)
+    if block is None:
+        # Codifica fuori dal lock (può essere chiamata da più thread); vince il primo inserito
+        media_kwargs = {"extension": extension} if extension else {}
+        block = MediaBlock(media=Media(
+            media_type="image",
+            source_type="base64",
+            source=_b64encode(image_bytes),
+            detail=detail,
+            **media_kwargs
+        ))
+        with _MEDIA_INTERN_LOCK:
+            block = _MEDIA_INTERN.setdefault(key, block)
+    return block
+
+
+# PNG 1x1 pixel trasparente
+_SAMPLE_PNG_B64 = "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mP8/5+hHgAHggJ/PchI7wAAAABJRU5ErkJggg=="
+
+
 def create_sample_image_base64() -> str:
     """
     Crea un'immagine di esempio in base64 (pixel 1x1 trasparente)
     Utile per test quando non abbiamo immagini reali
     """
-    # PNG 1x1 pixel trasparente
-    return "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mP8/5+hHgAHggJ/PchI7wAAAABJRU5ErkJggg=="
+    return _SAMPLE_PNG_B64
+
+
+# Estensioni riconosciute come immagini (confronto case-insensitive)
+IMAGE_EXTENSIONS = frozenset({'.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp'})
+
+
+@functools.lru_cache(maxsize=8)
+def _scan_files(directory: str, mtime_ns: int, extensions: frozenset) -> tuple:
+    """Coppie (nome, dimensione) dei file con le estensioni date
+    
+    L'mtime della directory nella chiave invalida la cache quando si aggiungono o
+    rimuovono file (non quando un file esistente viene riscritto: la dimensione è indicativa).
+    """
+    # Una sola lettura della directory invece di un glob per estensione e per maiuscole/minuscole
+    with os.scandir(directory) as entries:
+        return tuple(sorted(
+            (entry.name, entry.stat().st_size) for entry in entries
+            if os.path.splitext(entry.name)[1].lower() in extensions and entry.is_file()
+        ))
 
 
 def find_local_images() -> List[str]:
@@ -160,28 +536,28 @@ def find_local_images() -> List[str]:
     Returns:
         Lista di percorsi delle immagini trovate
     """
-    image_extensions = ['.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp']
-    current_dir = Path('.')
-    
-    found_images = []
-    for ext in image_extensions:
-        found_images.extend(current_dir.glob(f'*{ext}'))
-        found_images.extend(current_dir.glob(f'*{ext.upper()}'))
-    
-    return [str(img) for img in found_images]
+    return [name for name, _ in find_local_images_with_size()]
+
 
+def find_local_images_with_size() -> List[tuple]:
+    """Come find_local_images, con la dimensione in byte letta durante la scansione"""
+    # Percorso assoluto nella chiave: se la directory corrente cambia non si riusa la lista vecchia
+    cwd = os.getcwd()
+    return list(_scan_files(cwd, os.stat(cwd).st_mtime_ns, IMAGE_EXTENSIONS))
 
-def choose_image_source(interactive: bool = True) -> MediaBlock:
+
+def choose_image_source(interactive: bool = True, inline_urls: bool = False) -> MediaBlock:
     """
     Permette di scegliere tra immagine locale o dal web
     
     Args:
         interactive: Se True, mostra menu interattivo. Se False, usa default.
+        inline_urls: Se True, le immagini web vengono scaricate (con cache) e inviate in base64
         
     Returns:
         MediaBlock con l'immagine scelta
     """
-    local_images = find_local_images()
+    local_images = find_local_images_with_size()
     
     # URL di immagini di esempio dal web
     web_images = [
@@ -201,9 +577,9 @@ def choose_image_source(interactive: bool = True) -> MediaBlock:
     
     if not interactive:
         if local_images:
-            return create_mediablock_from_file(local_images[0])
+            return create_mediablock_from_file(local_images[0][0])
         else:
-            return create_mediablock_from_url(web_images[0]["url"])
+            return create_mediablock_from_url(web_images[0]["url"], inline=inline_urls)
     
     print("\n🖼️ Selezione Immagine")
     print("=" * 30)
@@ -213,10 +589,9 @@ def choose_image_source(interactive: bool = True) -> MediaBlock:
     # Aggiungi file locali
     if local_images:
         print(f"📁 File immagine locali disponibili:")
-        for file_path in local_images:
-            file_size = Path(file_path).stat().st_size
-            print(f"   {len(options) + 1}. {Path(file_path).name} ({file_size:,} bytes)")
-            options.append(("local", file_path))
+        for file_name, file_size in local_images:
+            print(f"   {len(options) + 1}. {file_name} ({file_size:,} bytes)")
+            options.append(("local", file_name))
     
     # Aggiungi opzioni web
     print(f"\n🌐 Immagini di esempio dal web:")
@@ -249,7 +624,7 @@ def choose_image_source(interactive: bool = True) -> MediaBlock:
         if source_type == "local":
             return create_mediablock_from_file(source_value)
         elif source_type == "web":
-            return create_mediablock_from_url(source_value)
+            return create_mediablock_from_url(source_value, inline=inline_urls)
         elif source_type == "sample":
             return create_sample_mediablock()
     except Exception as e:
@@ -258,71 +633,117 @@ def choose_image_source(interactive: bool = True) -> MediaBlock:
         return create_sample_mediablock()
 
 
-def create_mediablock_from_file(file_path: str) -> MediaBlock:
-    """Crea MediaBlock da file locale"""
-    image_b64 = load_image_as_base64(file_path)
-    if not image_b64:
-        raise ValueError(f"Impossibile caricare {file_path}")
+# Firme iniziali dei formati immagine (magic number) -> extension senza punto
+_IMAGE_SIGNATURES = (
+    (b'\x89PNG\r\n\x1a\n', "png"),
+    (b'\xff\xd8\xff', "jpeg"),
+    (b'GIF87a', "gif"),
+    (b'GIF89a', "gif"),
+    (b'BM', "bmp"),
+)
+
+
+def sniff_image_extension(image_bytes: bytes) -> Optional[str]:
+    """Extension reale dell'immagine dai primi byte, o None se il formato non è riconosciuto
     
-    # Determina l'extension dal file (senza punto per MIME type)
-    file_ext = Path(file_path).suffix.lower()
-    if not file_ext:
-        file_ext = ".png"  # Default fallback
+    Un file .png che in realtà è un JPEG verrebbe rifiutato dall'API solo dopo
+    l'invio dell'intero payload: i primi 12 byte bastano a evitarlo.
+    """
+    head = image_bytes[:12]
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return "webp"
+    for signature, extension in _IMAGE_SIGNATURES:
+        if head.startswith(signature):
+            return extension
+    return None
+
+
+def _intern_mapped_file(image_path: str, extension: str) -> Optional[MediaBlock]:
+    """MediaBlock di un file grande, hash e base64 calcolati sul file mappato in memoria
     
-    # Rimuovi il punto per MIME type corretto
-    extension_clean = file_ext.lstrip('.')
+    In RAM resta solo la stringa base64: i byte del file vengono letti dalla page
+    cache durante la codifica, senza copia in un bytes Python. Segnala l'errore e
+    restituisce None invece di sollevarlo, come _try_load_image_bytes.
+    """
+    try:
+        _check_media_size(image_path, os.path.getsize(image_path))
+        with open(image_path, "rb") as image_file:
+            with mmap.mmap(image_file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                _madvise_sequential(data)
+                return intern_image_block(data, sniff_image_extension(data) or extension)
+    except Exception as e:
+        print(f"⚠️ Errore caricamento {image_path}: {e}")
+        return None
+
+
+def create_mediablock_from_file(file_path: str) -> MediaBlock:
+    """Crea MediaBlock da file locale"""
+    # Extension dal contenuto, poi dal nome del file; senza punto per MIME type corretto
+    path = Path(file_path)
+    extension_clean = path.suffix.lstrip('.').lower() or "png"  # Default fallback
     
-    media = Media(
-        extension=extension_clean,
-        media_type="image",
-        source_type="base64",
-        source=image_b64,
-        detail="high"
-    )
+    if path.is_file() and path.stat().st_size > _STREAM_B64_THRESHOLD:
+        media_block = _intern_mapped_file(file_path, extension_clean)
+    else:
+        image_bytes = _try_load_image_bytes(file_path)
+        media_block = (
+            intern_image_block(image_bytes, sniff_image_extension(image_bytes) or extension_clean)
+            if image_bytes else None
+        )
+    if media_block is None:
+        raise ValueError(f"Impossibile caricare {file_path}")
     
-    print(f"✅ Caricata immagine locale: {Path(file_path).name}")
-    return MediaBlock(media=media)
+    print(f"✅ Caricata immagine locale: {path.name}")
+    return media_block
 
 
-def create_mediablock_from_url(url: str) -> MediaBlock:
-    """Crea MediaBlock da URL"""
-    # Cerca di determinare l'extension dall'URL
-    file_ext = None
-    for ext in ['.png', '.jpg', '.jpeg', '.gif', '.webp']:
-        if ext in url.lower():
-            file_ext = ext
-            break
-    if not file_ext:
-        file_ext = ".png"  # Default fallback
-    
-    # Rimuovi il punto per MIME type corretto
-    extension_clean = file_ext.lstrip('.')
+# Estensione immagine a fine path, eventualmente seguita da query string o fragment
+_EXT_RE = re.compile(r'\.(png|jpe?g|gif|webp)(?:$|[?#])', re.I)
+
+
+def create_mediablock_from_url(url: str, inline: bool = False) -> MediaBlock:
+    """Crea MediaBlock da URL (inline=True: byte scaricati tramite la cache e inviati in base64)"""
+    # Extension dalla fine del path (prima di query/fragment), senza punto per il MIME type
+    match = _EXT_RE.search(url)
+    extension_clean = match.group(1).lower() if match else "png"  # Default fallback
     
-    media = Media(
-        extension=extension_clean,
-        media_type="image",
-        source_type="url", 
-        source=url,
-        detail="high"
-    )
+    image_bytes = None
+    if inline:
+        try:
+            image_bytes = _IMAGE_CACHE.get(url)
+        except requests.RequestException as e:
+            print(f"⚠️ Download non riuscito, l'immagine viene inviata come URL: {e}")
+    if image_bytes is not None:
+        media_block = intern_image_block(image_bytes, sniff_image_extension(image_bytes) or extension_clean)
+    else:
+        media_block = MediaBlock(media=Media(
+            extension=extension_clean,
+            media_type="image",
+            source_type="url", 
+            source=url,
+            detail="high"
+        ))
     
     print(f"✅ Caricata immagine dal web: {url}")
-    return MediaBlock(media=media)
+    return media_block
 
 
-def create_sample_mediablock() -> MediaBlock:
-    """Crea MediaBlock con immagine di esempio"""
-    sample_base64 = create_sample_image_base64()
-    media = Media(
+@functools.lru_cache(maxsize=1)
+def _sample_mediablock() -> MediaBlock:
+    """MediaBlock dell'immagine di esempio, costruito una volta sola (non viene mai modificato)"""
+    return MediaBlock(media=Media(
         extension="png",  # Senza punto per MIME type corretto
         media_type="image",
         source_type="base64",
-        source=sample_base64,
+        source=_SAMPLE_PNG_B64,
         detail="high"
-    )
-    
+    ))
+
+
+def create_sample_mediablock() -> MediaBlock:
+    """Crea MediaBlock con immagine di esempio"""
     print("✅ Creata immagine di esempio (1x1 pixel)")
-    return MediaBlock(media=media)
+    return _sample_mediablock()
 
 
 def _select_provider(default: str = "openai") -> str:
@@ -336,6 +757,139 @@ def _select_provider(default: str = "openai") -> str:
     return options.get(choice, default)
 
 
+# Provider che accettano più immagini nella stessa richiesta
+_MULTI_IMAGE_PROVIDERS = frozenset({"openai"})
+
+
+async def analyze_batch(client, media_blocks: List[MediaBlock], prompt: str,
+                        single_request: bool = False, max_concurrency: int = 4) -> List[Union[str, Exception]]:
+    """
+    Analizza un batch di immagini con lo stesso prompt
+    
+    Args:
+        client: Client multimodale
+        media_blocks: Immagini da analizzare
+        prompt: Istruzione per l'analisi
+        single_request: Se True, tutte le immagini viaggiano in un'unica richiesta
+        max_concurrency: Richieste contemporanee al massimo (se single_request è False)
+        
+    Returns:
+        Una risposta per richiesta (o l'eccezione che l'ha fatta fallire)
+    """
+    if single_request:
+        response = await client.a_invoke(input=[TextBlock(content=prompt), *media_blocks])
+        return [response.text]
+    
+    semaphore = asyncio.Semaphore(max_concurrency)
+    
+    async def analyze(media_block: MediaBlock) -> str:
+        async with semaphore:
+            response = await client.a_invoke(input=[TextBlock(content=prompt), media_block])
+            return response.text
+    
+    return await asyncio.gather(*(analyze(mb) for mb in media_blocks), return_exceptions=True)
+
+
+# Token minimi del prefisso perché la prompt cache di OpenAI si attivi
+PROMPT_CACHE_MIN_TOKENS = 1024
+
+# Token per immagine secondo il dettaglio (high: 85 di base + 170 per tile, qui un solo tile)
+_IMAGE_TOKENS = {"low": 85, "high": 255}
+
+
+@functools.lru_cache(maxsize=8)
+def _token_encoding(model: str):
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("o200k_base")
+
+
+@functools.lru_cache(maxsize=4096)
+def count_tokens(text: str, model: str = "gpt-4o") -> int:
+    """Token del testo per il modello (circa 4 caratteri per token senza tiktoken)"""
+    if tiktoken is None:
+        return (len(text) + 3) // 4
+    return len(_token_encoding(model).encode(text))
+
+
+def estimate_prompt_tokens(memory: Memory, model: str = "gpt-4o") -> int:
+    """Stima dei token di input di una richiesta: system prompt più tutti i blocchi in memoria"""
+    total = count_tokens(MULTIMODAL_SYSTEM_PROMPT, model)
+    for block in memory.iter_blocks():
+        if isinstance(block, TextBlock):
+            total += count_tokens(block.content, model)
+        elif isinstance(block, MediaBlock):
+            total += _IMAGE_TOKENS.get(getattr(block.media, "detail", "high"), _IMAGE_TOKENS["high"])
+    return total
+
+
+class BoundedMemory(Memory):
+    """Memory a finestra: al massimo max_turns turni e max_chars caratteri di testo
+    
+    I turni in eccesso vengono rimossi a partire dal più vecchio. Se tra i turni rimossi
+    c'è un'immagine (o un riassunto precedente) e c'è un summarizer, le analisi fatte
+    vengono condensate in un unico turno di riassunto invece di andare perse; se il
+    summarizer fallisce i turni vengono semplicemente scartati.
+    """
+    
+    def __init__(self, max_turns: int = 10, max_chars: int = 32_000,
+                 summarizer: Optional[Callable[[Memory], str]] = None):
+        super().__init__()
+        self.max_turns = max_turns
+        self.max_chars = max_chars
+        self.summarizer = summarizer
+        self._summary_turns = set()
+    
+    @staticmethod
+    def _turn_chars(turn) -> int:
+        return sum(len(block.content) for block in getattr(turn, "blocks", ()) if isinstance(block, TextBlock))
+    
+    def add_turn(self, blocks, role):
+        super().add_turn(blocks, role)
+        self._truncate()
+    
+    def _truncate(self):
+        total_chars = sum(self._turn_chars(turn) for turn in self.memory)
+        evicted = []
+        while len(self.memory) > 1 and (len(self.memory) > self.max_turns or total_chars > self.max_chars):
+            turn = self.memory.pop(0)
+            total_chars -= self._turn_chars(turn)
+            evicted.append(turn)
+        if not evicted or self.summarizer is None:
+            return
+        
+        worth_keeping = any(
+            id(turn) in self._summary_turns
+            or any(isinstance(block, MediaBlock) for block in getattr(turn, "blocks", ()))
+            for turn in evicted
+        )
+        if not worth_keeping:
+            return
+        
+        # Il turno di riassunto occupa un posto nella finestra
+        extra = None
+        if len(self.memory) >= self.max_turns and len(self.memory) > 1:
+            extra = self.memory.pop(0)
+            evicted.append(extra)
+        
+        old = Memory()
+        old.memory.extend(evicted)
+        try:
+            text = self.summarizer(old)
+        except Exception as e:
+            # Errore del summarizer (rete, quota): i turni in eccesso vengono solo scartati
+            print(f"⚠️ Riassunto non riuscito, turni vecchi scartati: {e}")
+            if extra is not None:
+                self.memory.insert(0, extra)
+            return
+        summary = Memory()
+        summary.add_turn([TextBlock(content=f"[Riassunto analisi precedenti: {text}]")], ROLE.ASSISTANT)
+        self._summary_turns = {id(turn) for turn in self.memory if id(turn) in self._summary_turns}
+        self._summary_turns.update(id(turn) for turn in summary.memory)
+        self.memory[:0] = summary.memory
+
+
 # ==============================================================================
 # FUNZIONALITÀ PRINCIPALI
 # ==============================================================================
@@ -354,29 +908,196 @@ def demo_image_analysis():
     
     try:
         # Scelta dell'immagine
-        image_block = choose_image_source(interactive=True)
+        image_block = choose_image_source(interactive=True, inline_urls=provider in _URL_INLINE_PROVIDERS)
         
         # Analisi immagine con prompt specifico
+        prompt = "Analizza attentamente questa immagine e descrivi tutto quello che vedi in modo dettagliato, includendo colori, oggetti, persone, ambientazione e qualsiasi altro dettaglio rilevante."
         analysis_input = [
-            TextBlock(content="Analizza attentamente questa immagine e descrivi tutto quello che vedi in modo dettagliato, includendo colori, oggetti, persone, ambientazione e qualsiasi altro dettaglio rilevante."),
+            TextBlock(content=prompt),
             image_block
         ]
         
-        print("\n🔄 Analisi in corso...")
-        response = client.invoke(input=analysis_input)
+        # Stessa immagine + stesso prompt + stesso modello: risposta dalla cache su disco
+        cache = _analysis_cache()
+        cache_key = _analysis_cache_key(_PROVIDERS[provider]["model"], prompt, image_block)
+        cached = cache.get(cache_key) if cache is not None else None
+        
+        if cached is not None:
+            text, tokens = cached
+            print("\n📦 Analisi recuperata dalla cache")
+        else:
+            print("\n🔄 Analisi in corso...")
+            response = client.invoke(input=analysis_input)
+            text = response.text
+            tokens = response.prompt_tokens_used + response.completion_tokens_used
+            if cache is not None:
+                cache[cache_key] = (text, tokens)
         
         print("\n🤖 Analisi dell'immagine:")
-        print(f"   {response.text}")
+        print(f"   {text}")
         
-        print(f"\n📊 Token utilizzati: {response.prompt_tokens_used + response.completion_tokens_used}")
+        print(f"\n📊 Token utilizzati: {tokens}" + (" (risparmiati grazie alla cache)" if cached is not None else ""))
         
     except Exception as e:
         print(f"❌ Errore durante l'analisi: {e}")
 
 
-def demo_image_generation():
+def _async_http_client():
+    """Client HTTP asincrono per una esecuzione della demo, condiviso da generazioni DALL-E e download
+    
+    Il pool asincrono è legato all'event loop, e ogni asyncio.run ne crea uno nuovo:
+    per questo il client vive per una singola esecuzione invece che a livello di modulo.
+    Dentro l'esecuzione, con HTTP/2 generazioni e download viaggiano multiplexati
+    sulla stessa connessione.
+    """
+    if httpx is None:
+        return None
+    return httpx.AsyncClient(
+        http2=_HTTP2,
+        limits=httpx.Limits(max_keepalive_connections=16, max_connections=16),
+        timeout=httpx.Timeout(60, connect=5)
+    )
+
+
+# Dimensione dei blocchi scritti su disco durante i download
+_DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+
+def _download_to_file_sync(url: str, filename: str) -> int:
+    """Scarica url in filename a blocchi con la sessione requests condivisa; restituisce i byte scritti"""
+    total = 0
+    with _http_session().get(url, stream=True, timeout=30) as response:
+        response.raise_for_status()
+        with open(filename, "wb") as f:
+            for chunk in response.iter_content(_DOWNLOAD_CHUNK_SIZE):
+                f.write(chunk)
+                total += len(chunk)
+    return total
+
+
+async def _download_image(url: str, filename: str, http_client=None) -> int:
+    """
+    Scarica un'immagine direttamente su file senza bloccare l'event loop
+    
+    La risposta viene scritta a blocchi mentre arriva: in memoria c'è un blocco alla
+    volta invece dell'intero PNG. Con httpx usa il client asincrono, altrimenti
+    requests in un thread. In caso di errore il file parziale viene rimosso.
+    
+    Returns:
+        Byte scritti su disco
+    """
+    try:
+        if http_client is None:
+            return await asyncio.to_thread(_download_to_file_sync, url, filename)
+        
+        total = 0
+        async with http_client.stream("GET", url) as response:
+            response.raise_for_status()
+            with open(filename, "wb") as f:
+                async for chunk in response.aiter_bytes(_DOWNLOAD_CHUNK_SIZE):
+                    f.write(chunk)
+                    total += len(chunk)
+        return total
+    except BaseException:
+        Path(filename).unlink(missing_ok=True)
+        raise
+
+
+# Endpoint REST di generazione immagini: chiamato direttamente, senza il livello dell'SDK
+_IMAGES_ENDPOINT = "https://api.openai.com/v1/images/generations"
+
+
+async def _generate_image_url(http_client, api_key: str, prompt: str) -> str:
+    """Genera un'immagine con DALL-E 3 (POST diretta sul client httpx condiviso) e ne restituisce l'URL"""
+    response = await http_client.post(
+        _IMAGES_ENDPOINT,
+        headers={"Authorization": f"Bearer {api_key}"},
+        json={"model": "dall-e-3", "prompt": prompt, "size": "1024x1024", "quality": "standard", "n": 1}
+    )
+    if response.is_error:
+        try:
+            message = response.json()["error"]["message"]
+        except Exception:
+            message = response.text
+        raise RuntimeError(f"HTTP {response.status_code}: {message}")
+    return response.json()["data"][0]["url"]
+
+
+class AugmentCache:
+    """Cache persistente dei prompt augmentati, nella cache su disco delle analisi
+    
+    Prima cerca la descrizione identica (a meno di maiuscole e spazi), poi una
+    descrizione simile per coseno degli embedding (text-embedding-3-small) oltre soglia,
+    alta perché descrizioni che differiscono per un dettaglio restano molto vicine:
+    una parafrasi di una richiesta già vista riusa il prompt augmentato senza
+    chiamare GPT-5. Senza NumPy resta attiva solo la ricerca esatta, senza diskcache nessuna.
+    """
+    
+    _INDEX_KEY = "augment:index"
+    
+    def __init__(self, soglia: float = 0.97, max_voci: int = 256):
+        self.cache = _analysis_cache()
+        self.soglia = soglia
+        self.max_voci = max_voci
+    
+    @property
+    def semantica(self) -> bool:
+        return self.cache is not None and np is not None
+    
+    @staticmethod
+    def _key(description: str) -> str:
+        normalized = " ".join(description.lower().split())
+        return "augment:" + hashlib.blake2b(normalized.encode("utf-8"), digest_size=16).hexdigest()
+    
+    def get(self, description: str) -> Optional[str]:
+        if self.cache is None:
+            return None
+        return self.cache.get(self._key(description))
+    
+    def get_similar(self, embedding) -> Optional[str]:
+        """Prompt augmentato della descrizione più simile, se supera la soglia"""
+        if not self.semantica or embedding is None:
+            return None
+        index = self.cache.get(self._INDEX_KEY) or []
+        if not index:
+            return None
+        similarities = np.stack([vector for _, vector in index]) @ embedding
+        best = int(similarities.argmax())
+        if similarities[best] < self.soglia:
+            return None
+        return self.cache.get(index[best][0])
+    
+    def put(self, description: str, embedding, augmented: str):
+        if self.cache is None:
+            return
+        key = self._key(description)
+        self.cache.set(key, augmented)
+        if self.semantica and embedding is not None:
+            with self.cache.transact():
+                index = [item for item in self.cache.get(self._INDEX_KEY) or [] if item[0] != key]
+                index.append((key, embedding))
+                self.cache.set(self._INDEX_KEY, index[-self.max_voci:])
+
+
+async def _embed_description(description: str, api_key: str):
+    """Embedding normalizzato della descrizione, o None se NumPy/SDK OpenAI mancano o la chiamata fallisce"""
+    if np is None:
+        return None
+    try:
+        import openai
+        async with openai.AsyncOpenAI(api_key=api_key) as embedder:
+            response = await embedder.embeddings.create(model="text-embedding-3-small", input=description)
+    except Exception:
+        return None
+    vector = np.asarray(response.data[0].embedding, dtype=np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+async def demo_image_generation():
     """
     Genera immagini usando GPT-5 per augmentazione + DALL-E 3 per generazione
+    
+    Con più immagini richieste, generazioni e download partono in parallelo.
     """
     print_section("GENERAZIONE IMMAGINE - GPT-5 + DALL-E 3")
 
@@ -388,6 +1109,10 @@ def demo_image_generation():
     # Chiedi se augmentare il prompt
     augment = input("\nVuoi augmentare il prompt? (s/n): ").strip().lower() == 's'
     
+    # DALL-E 3 genera un'immagine per richiesta: più immagini = più richieste concorrenti
+    n_input = input("\nQuante immagini? (1-4, invio per 1): ").strip()
+    n_images = min(max(int(n_input), 1), 4) if n_input.isdigit() else 1
+    
     try:
         api_key = os.getenv("OPENAI_API_KEY")
         if not api_key:
@@ -396,7 +1121,17 @@ def demo_image_generation():
 
         # Client per augmentazione prompt (GPT-5)
         final_description = description
-        if augment:
+        augment_cache = AugmentCache()
+        cached_description = augment_cache.get(description) if augment else None
+        embedding = None
+        if augment and cached_description is None and augment_cache.semantica:
+            embedding = await _embed_description(description, api_key)
+            cached_description = augment_cache.get_similar(embedding)
+        
+        if cached_description is not None:
+            final_description = cached_description
+            print(f"\n📦 Prompt augmentato dalla cache: {final_description}")
+        elif augment:
             try:
                 gpt5_client = ClientFactory.create(
                     provider="openai",
@@ -416,8 +1151,9 @@ Aggiungi dettagli su:
 
 Rispondi solo con il prompt migliorato, max 400 caratteri."""
 
-                    augment_response = gpt5_client.invoke(augment_prompt)
+                    augment_response = await gpt5_client.a_invoke(augment_prompt)
                     final_description = augment_response.text.strip()
+                    augment_cache.put(description, embedding, final_description)
                     print(f"\nPrompt augmentato con GPT-5: {final_description}")
                 else:
                     print("⚠️ GPT-5 non disponibile, uso prompt originale")
@@ -426,52 +1162,49 @@ Rispondi solo con il prompt migliorato, max 400 caratteri."""
                 print("💡 Uso prompt originale")
 
         # Genera immagine con DALL-E 3
-        print("\n🔄 Generazione immagine con DALL-E 3...")
+        print(f"\n🔄 Generazione {n_images} immagine/i con DALL-E 3...")
+        
+        if httpx is None:
+            print("❌ Modulo 'httpx' non installato")
+            print("💡 Installa con: pip install httpx")
+            return
         
         try:
-            import openai
-            dalle_client = openai.OpenAI(api_key=api_key)
-            
-            response = dalle_client.images.generate(
-                model="dall-e-3",
-                prompt=final_description,
-                size="1024x1024",
-                quality="standard",
-                n=1
-            )
-            
-            image_url = response.data[0].url
-            print(f"✅ Immagine generata con DALL-E 3!")
-            print(f"🔗 URL: {image_url}")
-            
-            # Scarica e salva l'immagine in locale
-            print("\n🔄 Download immagine in corso...")
-            try:
-                # Download dell'immagine
-                img_response = requests.get(image_url, timeout=30)
-                img_response.raise_for_status()
+            # Un solo client HTTP per generazioni e download
+            async with _async_http_client() as http_client:
+                image_urls = await asyncio.gather(*(
+                    _generate_image_url(http_client, api_key, final_description)
+                    for _ in range(n_images)
+                ))
                 
-                # Nome file con timestamp
-                filename = f"generated_image_{int(time.time())}.png"
+                print(f"✅ Immagine generata con DALL-E 3!")
+                for image_url in image_urls:
+                    print(f"🔗 URL: {image_url}")
                 
-                # Salva l'immagine
-                with open(filename, "wb") as f:
-                    f.write(img_response.content)
+                # Nome file con timestamp (e indice se più immagini)
+                timestamp = int(time.time())
+                filenames = [
+                    f"generated_image_{timestamp}.png" if n_images == 1 else f"generated_image_{timestamp}_{i}.png"
+                    for i in range(1, n_images + 1)
+                ]
                 
-                print(f"✅ Immagine salvata: {filename}")
-                print(f"📏 Dimensione: {len(img_response.content):,} bytes")
+                # Scarica e salva le immagini in locale, tutti i download insieme
+                print("\n🔄 Download immagine in corso...")
+                downloads = await asyncio.gather(
+                    *(_download_image(image_url, filename, http_client)
+                      for image_url, filename in zip(image_urls, filenames)),
+                    return_exceptions=True
+                )
+            
+            for image_url, filename, size in zip(image_urls, filenames, downloads):
+                if isinstance(size, Exception):
+                    print(f"❌ Errore download: {size}")
+                    print(f"🔗 URL disponibile: {image_url}")
+                    continue
                 
-            except ImportError:
-                print("❌ Modulo 'requests' non installato per download")
-                print("💡 Installa con: pip install requests")
-                print(f"🔗 URL disponibile: {image_url}")
-            except Exception as e:
-                print(f"❌ Errore download: {e}")
-                print(f"🔗 URL disponibile: {image_url}")
+                print(f"✅ Immagine salvata: {filename}")
+                print(f"📏 Dimensione: {size:,} bytes")
                 
-        except ImportError:
-            print("❌ Modulo 'openai' non installato")
-            print("💡 Installa con: pip install openai")
         except Exception as e:
             print(f"❌ Errore DALL-E 3: {e}")
         
@@ -489,14 +1222,22 @@ def demo_conversational_analysis():
     if not client:
         return
     
-    memory = Memory()
+    # Memoria limitata: oltre la finestra i turni con immagini vengono riassunti
+    def summarize(old_memory: Memory) -> str:
+        return client.invoke("Riassumi brevemente le analisi fatte finora, con i dettagli tecnici principali",
+                             memory=old_memory).text
+    
+    memory = BoundedMemory(max_turns=10, max_chars=32_000, summarizer=summarize)
     
     print("🎭 Simulazione: Analisi fotografica professionale")
     print("   L'assistente dovrebbe ricordare le analisi precedenti\n")
     
-    # Prepara l'immagine per la conversazione
+    # Prepara l'immagine per la conversazione. L'immagine resta in memoria e viene
+    # rinviata a ogni turno: da URL si scarica una volta sola (cache su disco, GET
+    # condizionale) e si invia in base64, invece di far riscaricare l'URL al provider
+    # a ogni richiesta
     try:
-        image_block = choose_image_source(interactive=True)
+        image_block = choose_image_source(interactive=True, inline_urls=True)
     except Exception as e:
         print(f"❌ Errore selezione immagine: {e}")
         return
@@ -510,12 +1251,19 @@ def demo_conversational_analysis():
         if media_block:
             print("   📷 [Immagine inclusa]")
         
-        # Prepara l'input
+        # Il prefisso già inviato (memoria prima di questo turno) è riusabile dalla
+        # prompt cache solo oltre la soglia minima di token
+        prefix_tokens = estimate_prompt_tokens(memory)
+        
+        # Prepara l'input: contenuto statico (immagine) prima, testo variabile dopo
         input_blocks = [TextBlock(content=text_content)]
         if media_block:
-            input_blocks.append(media_block)
+            input_blocks.insert(0, media_block)
         
-        # Aggiungi alla memoria
+        # Aggiungi alla memoria. La memoria cresce solo in coda e i turni passati non
+        # vengono mai riscritti: il prefisso (system prompt, immagine, turni precedenti)
+        # resta identico tra le richieste e la prompt cache automatica del provider lo
+        # riusa, facendo pagare a prezzo pieno solo il turno nuovo
         memory.add_turn(input_blocks, ROLE.USER)
         
         try:
@@ -524,6 +1272,11 @@ def demo_conversational_analysis():
             
             print(f"🤖 Assistente: {response.text}")
             print(f"   📊 Token: {response.prompt_tokens_used + response.completion_tokens_used}")
+            cached_tokens = getattr(response, "cached_tokens_used", 0)
+            if cached_tokens:
+                print(f"   📦 Token dalla prompt cache: {cached_tokens}")
+            elif prefix_tokens < PROMPT_CACHE_MIN_TOKENS:
+                print(f"   📦 Prefisso di ~{prefix_tokens} token: sotto la soglia della prompt cache ({PROMPT_CACHE_MIN_TOKENS})")
             
         except Exception as e:
             print(f"❌ Errore: {e}")
@@ -556,13 +1309,13 @@ def demo_conversational_analysis():
     
     # Statistiche finali
     print_subsection("Statistiche Conversazione Multimodale")
-    print(f"   📚 Turni totali: {len(memory.memory)}")
-    print(f"   💬 Blocchi totali: {len(list(memory.iter_blocks()))}")
-    
-    # Conta i tipi di blocchi
-    text_blocks = sum(1 for block in memory.iter_blocks() if isinstance(block, TextBlock))
-    media_blocks_count = sum(1 for block in memory.iter_blocks() if isinstance(block, MediaBlock))
+    # Conta i tipi di blocchi con un solo passaggio sulla memoria
+    block_counts = Counter(type(block) for block in memory.iter_blocks())
+    text_blocks = block_counts[TextBlock]
+    media_blocks_count = block_counts[MediaBlock]
     
+    print(f"   📚 Turni totali: {len(memory.memory)}")
+    print(f"   💬 Blocchi totali: {sum(block_counts.values())}")
     print(f"   📝 Blocchi testo: {text_blocks}")
     print(f"   🖼️ Blocchi media: {media_blocks_count}")
 
@@ -576,31 +1329,24 @@ def demo_file_management():
     print_subsection("1. Ricerca file immagine nella directory corrente")
     
     # Cerca file immagine comuni
-    found_images = find_local_images()
+    found_images_sizes = find_local_images_with_size()
+    found_images = [name for name, _ in found_images_sizes]
     
     if found_images:
         print(f"   📁 Trovate {len(found_images)} immagini:")
-        for img in found_images[:5]:  # Mostra max 5
-            img_path = Path(img)
-            print(f"      - {img_path.name} ({img_path.stat().st_size} bytes)")
+        for img_name, img_size in found_images_sizes[:5]:  # Mostra max 5
+            print(f"      - {img_name} ({img_size} bytes)")
         
         # Test caricamento del primo file trovato
         first_image = found_images[0]
         print(f"\n   🔄 Test caricamento {Path(first_image).name}...")
         
-        image_b64 = load_image_as_base64(first_image)
-        if image_b64:
-            print(f"   ✅ Caricamento riuscito: {len(image_b64)} caratteri base64")
-            
+        image_bytes = _try_load_image_bytes(first_image)
+        if image_bytes:
             # Crea MediaBlock dal file locale
             try:
-                local_media = Media(
-                    media_type="image",
-                    source_type="base64",
-                    source=image_b64,
-                    detail="high"
-                )
-                media_block = MediaBlock(media=local_media)
+                media_block = intern_image_block(image_bytes)
+                print(f"   ✅ Caricamento riuscito: {len(media_block.media.source)} caratteri base64")
                 print(f"   ✅ MediaBlock creato da file locale")
                 
             except Exception as e:
@@ -613,26 +1359,45 @@ def demo_file_management():
     
     print_subsection("2. Creazione helper per batch di immagini")
     
-    def create_media_batch(image_paths: List[str], max_images: int = 3) -> List[MediaBlock]:
-        """Crea un batch di MediaBlock da file locali"""
+    def create_media_batch(image_paths: List[str], max_images: int = 3,
+                           detail: str = "low", max_dim: int = 512) -> List[MediaBlock]:
+        """Crea un batch di MediaBlock da file locali
+        
+        Con detail="low" il modello lavora comunque a bassa risoluzione: le immagini
+        vengono ridotte a max_dim pixel prima dell'invio (serve Pillow), con payload
+        e token di visione molto più piccoli.
+        """
         media_blocks = []
+        paths = image_paths[:max_images]
+        resize = max_dim if detail == "low" and Image is not None else None
         
-        for i, path in enumerate(image_paths[:max_images]):
-            image_b64 = load_image_as_base64(path)
-            if image_b64:
-                try:
-                    media = Media(
-                        media_type="image", 
-                        source_type="base64",
-                        source=image_b64,
-                        detail="high"
-                    )
-                    media_blocks.append(MediaBlock(media=media))
-                    print(f"   ✅ Batch {i+1}: {Path(path).name}")
-                except Exception as e:
-                    print(f"   ❌ Batch {i+1} errore: {e}")
-            else:
+        def load(path: str):
+            """Lettura, hash e codifica base64 di un file: (MediaBlock, None) o (None, errore)"""
+            image_bytes = _try_load_image_bytes(path, resize)
+            if not image_bytes:
+                return None, None
+            try:
+                return intern_image_block(image_bytes, sniff_image_extension(image_bytes), detail), None
+            except Exception as e:
+                return None, e
+        
+        # File in parallelo: read, SHA-256 e pybase64 rilasciano il GIL. map mantiene l'ordine
+        if len(paths) > 1:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=min(8, len(paths))) as pool:
+                loaded = list(pool.map(load, paths))
+        else:
+            loaded = [load(path) for path in paths]
+        
+        for i, (path, (media_block, error)) in enumerate(zip(paths, loaded)):
+            if error is not None:
+                print(f"   ❌ Batch {i+1} errore: {error}")
+            elif media_block is None:
                 print(f"   ⏭️ Batch {i+1}: {Path(path).name} saltato")
+            elif any(block is media_block for block in media_blocks):
+                print(f"   ⏭️ Batch {i+1}: {Path(path).name} duplicato, saltato")
+            else:
+                media_blocks.append(media_block)
+                print(f"   ✅ Batch {i+1}: {Path(path).name}")
         
         return media_blocks
     
@@ -642,24 +1407,50 @@ def demo_file_management():
         batch = create_media_batch([str(img) for img in found_images])
         print(f"   📦 Batch creato: {len(batch)} immagini pronte")
     else:
+        batch = []
         print("   ⏭️ Test batch saltato (nessuna immagine)")
+    
+    print_subsection("3. Analisi del batch di immagini")
+    
+    if not batch:
+        print("   ⏭️ Analisi saltata (batch vuoto)")
+        return
+    if input("   👉 Vuoi analizzare il batch? (s/n): ").strip().lower() != 's':
+        print("   ⏭️ Analisi saltata")
+        return
+    
+    provider = "openai"
+    client = create_multimodal_client(provider, use_cache=True)
+    if not client:
+        return
+    
+    # Con OpenAI un'unica richiesta con tutte le immagini, altrimenti richieste concorrenti
+    single_request = provider in _MULTI_IMAGE_PROVIDERS
+    prompt = ("Descrivi brevemente ciascuna immagine, numerandole nell'ordine in cui le ricevi."
+              if single_request else "Descrivi brevemente questa immagine.")
+    
+    print(f"   🔄 Analisi di {len(batch)} immagini {'in una richiesta' if single_request else 'in parallelo'}...")
+    results = asyncio.run(analyze_batch(client, batch, prompt, single_request=single_request))
+    
+    for i, result in enumerate(results, 1):
+        if isinstance(result, Exception):
+            print(f"   ❌ Analisi {i} fallita: {result}")
+        else:
+            print(f"   🤖 {result}" if single_request else f"   🤖 Immagine {i}: {result}")
 
 
 # ==============================================================================
 # FUNZIONE PRINCIPALE E MENU
 # ==============================================================================
 
-def show_main_menu():
-    """Mostra il menu principale"""
-    print_section("DATAPIZZAI - Analisi e generazione immagini")
-    
-    # Mostra informazioni sui file disponibili
-    local_images = find_local_images()
-    
-    print("File disponibili nella directory:")
-    print(f"   Immagini: {len(local_images)} file")
-    
-    print("""
+# Menu completo (intestazione inclusa) composto una volta: a ogni giro cambia solo il numero di immagini
+_MENU_TEXT = (
+    "\n" + "=" * 65 + "\n"
+    " DATAPIZZAI - Analisi e generazione immagini\n"
+    + "=" * 65 + "\n"
+    """File disponibili nella directory:
+   Immagini: {n_images} file
+
 Da cosa vuoi partire?
 
 1. Analizza immagine → Carica e analizza un'immagine
@@ -668,14 +1459,22 @@ Da cosa vuoi partire?
 4. Gestione file → Esplora immagini locali
 
 0. Esci
-    """)
+    
+"""
+)
+
+
+def show_main_menu():
+    """Mostra il menu principale"""
+    # Una sola scrittura per tutto il menu
+    sys.stdout.write(_MENU_TEXT.format(n_images=len(find_local_images())))
 
 
 def run_main_demo(choice: str):
     """Esegue la demo principale selezionata"""
     demos = {
         "1": demo_image_analysis,
-        "2": demo_image_generation,
+        "2": lambda: asyncio.run(demo_image_generation()),
         "3": demo_conversational_analysis,
         "4": demo_file_management
     }
@@ -13,6 +13,7 @@ Data: 2025
 
 import os
 import time
+import asyncio
 from dotenv import load_dotenv
 
 # Carica le variabili d'ambiente dal file .env nella directory parent
@@ -106,6 +107,30 @@ def create_client(provider_name: str = "openai", use_cache: bool = False):
 # MODALITÀ ONE-SHOT (Singola Query → Risposta)
 # ==============================================================================
 
+# Richieste contemporanee massime verso il provider (limiti RPM)
+MAX_CONCURRENT_REQUESTS = 8
+
+
+async def _ainvoke_timed(client, prompt, semaphore: asyncio.Semaphore):
+    """Invoca il client senza bloccare l'event loop; restituisce (risposta, secondi)"""
+    async with semaphore:
+        start_time = time.perf_counter()
+        if hasattr(client, "a_invoke"):
+            response = await client.a_invoke(prompt)
+        else:
+            response = await asyncio.to_thread(client.invoke, prompt)
+        return response, time.perf_counter() - start_time
+
+
+async def _ainvoke_all(client, prompts: list) -> list:
+    """Prompt indipendenti in parallelo: (risposta, secondi) o eccezione, nell'ordine dei prompt"""
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+    return await asyncio.gather(
+        *(_ainvoke_timed(client, prompt, semaphore) for prompt in prompts),
+        return_exceptions=True
+    )
+
+
 def demo_one_shot_basic():
     """
     Dimostra l'utilizzo base one-shot con diverse tipologie di prompt
@@ -142,32 +167,34 @@ def demo_one_shot_basic():
         }
     ]
     
-    for i, example in enumerate(prompts, 1):
+    # I prompt sono indipendenti: partono tutti insieme, il tempo totale è quello del più lento
+    start_time = time.perf_counter()
+    results = asyncio.run(_ainvoke_all(client, [example['prompt'] for example in prompts]))
+    print(f"⏱️ {len(prompts)} richieste completate in {time.perf_counter() - start_time:.2f}s")
+    
+    for i, (example, result) in enumerate(zip(prompts, results), 1):
         print_subsection(f"{i}. {example['name']}")
         print(f"Descrizione: {example['description']}")
         print(f"Prompt: '{example['prompt']}'")
         
         try:
-            # Misuriamo il tempo di risposta
-            start_time = time.time()
-            
-            # Invocazione semplice con stringa
-            response = client.invoke(example['prompt'])
-            
-            end_time = time.time()
+            if isinstance(result, Exception):
+                raise result
+            response, elapsed = result
             
             # Mostra i risultati
             print(f"\n🤖 Risposta:")
             print(f"   {response.text}")
             print(f"\n📊 Statistiche:")
-            print(f"   ⏱️ Tempo: {end_time - start_time:.2f}s")
+            print(f"   ⏱️ Tempo: {elapsed:.2f}s")
             print(f"   🎯 Token prompt: {response.prompt_tokens_used}")
             print(f"   💬 Token risposta: {response.completion_tokens_used}")
             print(f"   🔄 Stop reason: {response.stop_reason}")
             
             # Se c'è cache, mostra se è stato un hit
-            if hasattr(response, 'cached_tokens_used') and response.cached_tokens_used:
-                print(f"   📦 Cache hit: {response.cached_tokens_used} token dalla cache")
+            cached_tokens = getattr(response, 'cached_tokens_used', None)
+            if cached_tokens:
+                print(f"   📦 Cache hit: {cached_tokens} token dalla cache")
                 
         except Exception as e:
             print(f"   ❌ Errore: {e}")